@@ -32,13 +32,15 @@ __author__ = "Clark Williams <williams@redhat.com>, David Sommerseth <davids@red
 __license__ = "GPLv2 License"
 
 import os, signal, sys, threading, time
+import schedutils
 from datetime import datetime
 from distutils import sysconfig
 from modules.loads import LoadModules
-from modules.measurement import MeasurementModules, MeasurementProfile
+from modules.measurement import MeasurementModules, MeasurementProfile, percentiles_converged
 from rtevalReport import rtevalReport
 from rtevalXMLRPC import rtevalXMLRPC
 from sysinfo.tools import mkdir
+from sysinfo.cputopology import parse_cpulist, collapse_cpulist, online_cpus
 from Log import Log
 import rtevalConfig, rtevalMailer
 import version
@@ -80,6 +82,9 @@ class RtEval(rtevalReport):
 
         self.__rtevcfg = self.__cfg.GetSection('rteval')
         self.__reportdir = None
+        self.__wakeup = threading.Event()
+        # The number of CPUs the loads run on, set by Prepare()
+        self.__loadcores = None
 
         # Import SystemInfo here, to avoid DMI warnings if RtEval() is not used
         from sysinfo import SystemInfo
@@ -126,6 +131,50 @@ class RtEval(rtevalReport):
         print "rteval time remaining: %d days, %d hours, %d minutes, %d seconds" % (days, hours, minutes, r)
 
 
+    def __cpu_placement(self):
+        """Returns the (measure, housekeeping) cpulists from --measure-cpus and
+--housekeeping-cpus, where a missing list is the remaining online CPUs.  Returns
+(None, None) when no placement is requested"""
+        measure = self.__rtevcfg.measure_cpulist
+        housekeeping = self.__rtevcfg.housekeeping_cpulist
+        if not (measure or housekeeping):
+            return (None, None)
+
+        online = online_cpus()
+        mcpus = measure and [c for c in parse_cpulist(measure) if c in online] or []
+        hcpus = housekeeping and [c for c in parse_cpulist(housekeeping) if c in online] or []
+        if not measure:
+            mcpus = [c for c in online if c not in hcpus]
+        if not housekeeping:
+            hcpus = [c for c in online if c not in mcpus]
+
+        if not mcpus:
+            raise RuntimeError("No online CPUs to measure on")
+        if not hcpus:
+            raise RuntimeError("No online housekeeping CPUs left for the loads and rteval")
+
+        shared = [c for c in mcpus if c in hcpus]
+        if shared:
+            self.__logger.log(Log.WARN, "CPUs %s are both measured and used for housekeeping"
+                              % collapse_cpulist(shared))
+        return (collapse_cpulist(mcpus), collapse_cpulist(hcpus))
+
+
+    def __load_ramp(self):
+        """Returns the list of load levels from --load-ramp, in percent of the default
+load intensity, or None when the run is not staged"""
+        ramp = self.__rtevcfg.load_ramp
+        if not ramp:
+            return None
+
+        levels = [float(l) for l in str(ramp).split(',') if l.strip()]
+        if not levels or min(levels) < 0:
+            raise ValueError("Invalid load ramp: %s" % ramp)
+        if self.__rtevcfg.load_target:
+            raise ValueError("A load ramp can't be combined with a load target")
+        return levels
+
+
     def Prepare(self, onlyload = False):
         builddir = os.path.join(self.__rtevcfg.workdir, 'rteval-build')
         if not os.path.isdir(builddir):
@@ -140,6 +189,19 @@ class RtEval(rtevalReport):
         except Exception, e:
             raise RuntimeError("Cannot create report directory (NFS with rootsquash on?) [%s]", str(e))
 
+        (measure, housekeeping) = self.__cpu_placement()
+        self.__load_ramp()
+        if housekeeping:
+            # Keep rteval itself off the measured CPUs.  Threads started
+            # from now on inherit this affinity.
+            self.__logger.log(Log.INFO, "Measuring CPUs %s, housekeeping on CPUs %s"
+                              % (measure, housekeeping))
+            schedutils.set_affinity(os.getpid(), parse_cpulist(housekeeping))
+            numcores = len(parse_cpulist(housekeeping))
+        else:
+            numcores = self._sysinfo.cpu_getCores(True)
+        self.__loadcores = numcores
+
         self.__logger.log(Log.INFO, "Preparing load modules")
         params = {'workdir':self.__rtevcfg.workdir,
                   'reportdir':self.__reportdir and self.__reportdir or "",
@@ -147,11 +209,15 @@ class RtEval(rtevalReport):
                   'srcdir':self.__rtevcfg.srcdir,
                   'verbose': self.__rtevcfg.verbose,
                   'debugging': self.__rtevcfg.debugging,
-                  'numcores':self._sysinfo.cpu_getCores(True),
+                  'numcores':numcores,
                   'logging':self.__rtevcfg.logging,
                   'memsize':self._sysinfo.mem_get_size(),
                   'numanodes':self._sysinfo.mem_get_numa_nodes(),
                   'duration': float(self.__rtevcfg.duration),
+                  'measure_cpulist': measure,
+                  'housekeeping_cpulist': housekeeping,
+                  'converge': self.__rtevcfg.converge,
+                  'load_ramp': self.__rtevcfg.load_ramp,
                   }
         self._loadmods.Setup(params)
 
@@ -159,6 +225,23 @@ class RtEval(rtevalReport):
         self._measuremods.Setup(params)
 
 
+    def __converged(self, measure_profile, history):
+        """Appends the live estimates of the --converge percentile to history.  Returns
+True when the estimates of all measured items have stayed within the tolerance for
+--converge-windows windows in a row, see percentiles_converged()"""
+        quantile = self.__rtevcfg.converge
+        tolerance = float(self.__rtevcfg.converge_tolerance) / 100.0
+        windows = int(self.__rtevcfg.converge_windows)
+
+        current = {}
+        for (modname, pct) in measure_profile.GetLivePercentiles(quantile):
+            for (key, bounds) in pct.items():
+                current["%s/%s" % (modname, key)] = bounds
+        history.append(current)
+        del history[:-(windows + 1)]
+        return percentiles_converged(history, tolerance, windows)
+
+
     def __RunMeasurementProfile(self, measure_profile):
         if not isinstance(measure_profile, MeasurementProfile):
             raise Exception("measure_profile is not an MeasurementProfile object")
@@ -168,14 +251,18 @@ class RtEval(rtevalReport):
         self.__logger.log(Log.INFO, "Using measurement profile [loads: %s  parallel: %s]" % (
                 with_loads, run_parallel))
         try:
-            nthreads = 0
+            # Let the modules wake up the measurement loop below
+            self.__wakeup.clear()
+            poll_interval = float(self.__rtevcfg.poll_interval)
+            measure_profile.SetWakeupEvent(self.__wakeup, poll_interval)
+            self._loadmods.SetWakeupEvent(self.__wakeup, poll_interval)
 
             # start the loads
             if with_loads:
                 self._loadmods.Start()
 
             print "rteval run on %s started at %s" % (os.uname()[2], time.asctime())
-            print "started %d loads on %d cores" % (self._loadmods.ModulesLoaded(), self._sysinfo.cpu_getCores(True)),
+            print "started %d loads on %d cores" % (self._loadmods.ModulesLoaded(), self.__loadcores),
             if self._sysinfo.mem_get_numa_nodes() > 1:
                 print " with %d numa nodes" % self._sysinfo.mem_get_numa_nodes()
             else:
@@ -187,7 +274,11 @@ class RtEval(rtevalReport):
 
             # Uleash the loads and measurement threads
             report_interval = int(self.__rtevcfg.report_interval)
-            nthreads = with_loads and self._loadmods.Unleash() or None
+            ramp = self.__load_ramp()
+            if ramp and with_loads:
+                self._loadmods.SetIntensity(ramp[0] / 100.0)
+            if with_loads:
+                self._loadmods.Unleash()
             self.__logger.log(Log.INFO, "Waiting 30 seconds to let load modules settle down")
             time.sleep(30)
             measure_profile.Unleash()
@@ -200,30 +291,79 @@ class RtEval(rtevalReport):
             stoptime = (time.time() + float(self.__rtevcfg.duration))
             currtime = time.time()
             rpttime = currtime + report_interval
-            load_avg_checked = 5
+            converge = self.__rtevcfg.converge
+            if converge:
+                # The duration is the upper limit of an adaptive run
+                self.__logger.log(Log.INFO, "running until the p%s latencies converge" % converge)
+                window = float(self.__rtevcfg.converge_interval)
+                nextwindow = currtime + window
+                history = []
+                self._convergence = (converge, False)
+            if ramp:
+                # A staged run, holding each load level for an equal share of
+                # the duration.  After a change of the load level, the loads
+                # settle before the latencies count for the stage.
+                stagelen = float(self.__rtevcfg.duration) / len(ramp)
+                settle = min(float(self.__rtevcfg.load_ramp_settle), stagelen / 2)
+                stage = 0
+                print "load stage 0: %g%% load for %d seconds" % (ramp[0], stagelen)
+                measure_profile.SetStage(stage, ramp[stage])
+                nextstage = currtime + stagelen
+                stagestart = None
             while (currtime <= stoptime) and not sigint_received:
-                time.sleep(60.0)
+                # Sleep until a module finishes, fails or aborts the run,
+                # or until the next poll
+                self.__wakeup.wait(max(min(poll_interval, stoptime - currtime), 0.01))
+                self.__wakeup.clear()
+
+                aborted = measure_profile.GetAbortReasons()
+                if aborted:
+                    for (modname, reason) in aborted:
+                        self.__logger.log(Log.WARN, "%s aborted the run: %s" % (modname, reason))
+                    self._aborted.extend(aborted)
+                    break
+
+                if converge and time.time() >= nextwindow:
+                    nextwindow += window
+                    if self.__converged(measure_profile, history):
+                        print "p%s latencies converged, stopping the run" % converge
+                        self._convergence = (converge, True)
+                        break
+
+                if ramp:
+                    now = time.time()
+                    if stagestart and now >= stagestart:
+                        measure_profile.SetStage(stage, ramp[stage])
+                        stagestart = None
+                    if now >= nextstage and stage + 1 < len(ramp):
+                        stage += 1
+                        nextstage += stagelen
+                        print "load stage %d: %g%% load for %d seconds" % (stage, ramp[stage], stagelen)
+                        if with_loads:
+                            self._loadmods.SetIntensity(ramp[stage] / 100.0)
+                        measure_profile.SetStage(None, None)
+                        stagestart = now + settle
+
                 if not measure_profile.isAlive():
                     stoptime = currtime
                     self.__logger.log(Log.WARN,
                                       "Measurement threads did not use the full time slot. Doing a controlled stop.")
 
                 if with_loads:
-                    if len(threading.enumerate()) < nthreads:
-                        raise RuntimeError, "load thread died!"
-
-                if not load_avg_checked:
-                    self._loadmods.SaveLoadAvg()
-                    load_avg_checked = 5
-                else:
-                    load_avg_checked -= 1
+                    dead = self._loadmods.GetDeadModules()
+                    if dead:
+                        raise RuntimeError, "load module died: %s" % ", ".join(dead)
 
+                currtime = time.time()
                 if currtime >= rpttime:
                     left_to_run = stoptime - currtime
                     self.__show_remaining_time(left_to_run)
                     rpttime = currtime + report_interval
                     print "load average: %.2f" % self._loadmods.GetLoadAvg()
-                currtime = time.time()
+                    if with_loads and self._loadmods.GetIntensity() is not None:
+                        print "load intensity: %.2f" % self._loadmods.GetIntensity()
+                    for (modname, status) in measure_profile.GetLiveStatus():
+                        print "%s %s" % (modname, status)
 
             self.__logger.log(Log.DEBUG, "out of measurement loop")
             signal.signal(signal.SIGINT, signal.SIG_DFL)
@@ -245,6 +385,12 @@ class RtEval(rtevalReport):
         # wait for measurement modules to finish calculating stats
         measure_profile.WaitForCompletion()
 
+        # The final results may show the run failed, even if it was not aborted
+        for (modname, reason) in measure_profile.GetAbortReasons():
+            if (modname, reason) not in self._aborted:
+                self.__logger.log(Log.WARN, "%s failed the run: %s" % (modname, reason))
+                self._aborted.append((modname, reason))
+
         return measure_start
 
 
@@ -256,8 +402,14 @@ class RtEval(rtevalReport):
             mstart = self.__RunMeasurementProfile(meas_prf)
             if measure_start is None:
                 measure_start = mstart
+            if self._aborted:
+                # Don't run the remaining profiles, but report what was measured
+                rtevalres = 1
+                break
 
         self._report(measure_start, self.__rtevcfg.xslt_report)
+        if self.__rtevcfg.timings:
+            self._write_timings()
         if self.__rtevcfg.sysreport:
             self._sysinfo.run_sysreport(self.__reportdir)
 
@@ -27,9 +27,9 @@
 from rteval.Log import Log
 from rteval.rtevalConfig import rtevalCfgSection
 from datetime import datetime
-import time, libxml2, threading, optparse
+import os, sys, time, signal, libxml2, threading, optparse, multiprocessing, traceback
 
-__all__ = ["rtevalRuntimeError", "rtevalModulePrototype", "ModuleContainer", "RtEvalModules"]
+__all__ = ["rtevalRuntimeError", "rtevalModulePrototype", "ModuleProcess", "ModuleContainer", "RtEvalModules"]
 
 class rtevalRuntimeError(RuntimeError):
     def __init__(self, mod, message):
@@ -53,11 +53,23 @@ class rtevalModulePrototype(threading.Thread):
         self.__logger = logger
         self.__ready = False
         self.__runtimeError = False
+        self.__abortReason = None
         self.__events = {"start": threading.Event(),
                          "stop": threading.Event(),
                          "finished": threading.Event()}
+        self.__wakeup = None
+        self.__readycond = None
+        self.__preparestart = None
+        self.__timetoready = None
         self._donotrun = False
         self.__timestamps = {}
+        # [calls, total, min, max] seconds spent in each module phase
+        self.__timings = {}
+        # How often the workload is checked, and how often _WorkloadTask() is
+        # called while it runs, in seconds.  A dead workload is noticed within
+        # the poll interval, a check only costs a poll() of its processes.
+        self._poll_interval = 0.25
+        self._task_interval = 60.0
 
 
     def _log(self, logtype, msg):
@@ -76,6 +88,27 @@ class rtevalModulePrototype(threading.Thread):
     def _setReady(self, state=True):
         "Sets the ready flag for the module"
         self.__ready = state
+        if state and self.__timetoready is None and self.__preparestart is not None:
+            self.__timetoready = time.time() - self.__preparestart
+        self.__notifyReady()
+
+
+    def TimeToReady(self):
+        "Returns the number of seconds the module spent getting ready, or None if it isn't ready"
+        return self.__timetoready
+
+
+    def SetReadyCondition(self, cond):
+        """Sets a threading.Condition() object which is notified when the module gets
+ready or has a RuntimeError"""
+        self.__readycond = cond
+
+
+    def __notifyReady(self):
+        if self.__readycond:
+            self.__readycond.acquire()
+            self.__readycond.notifyAll()
+            self.__readycond.release()
 
 
     def hadRuntimeError(self):
@@ -86,6 +119,33 @@ class rtevalModulePrototype(threading.Thread):
     def _setRuntimeError(self, state=True):
         "Sets the runtimeError flag for the module"
         self.__runtimeError = state
+        self.__notifyReady()
+        self.__notify()
+
+
+    def SetWakeupEvent(self, event, poll_interval=None):
+        """Sets a threading.Event() object which is set when the module finishes, fails or
+requests an abort, for the controlling thread to react without polling"""
+        self.__wakeup = event
+        if poll_interval:
+            self._poll_interval = float(poll_interval)
+
+
+    def __notify(self):
+        if self.__wakeup:
+            self.__wakeup.set()
+
+
+    def AbortReason(self):
+        "Returns the reason if the module requested the whole run to be aborted, otherwise None"
+        return self.__abortReason
+
+
+    def _setAbort(self, reason):
+        "Requests the whole run to be aborted, such as when a measurement already failed"
+        self.__abortReason = reason
+        self._log(Log.WARN, "requesting the run to be aborted: %s" % reason)
+        self.__notify()
 
 
     def setStart(self):
@@ -114,6 +174,7 @@ class rtevalModulePrototype(threading.Thread):
         "Sets the finished event state - indicating the module has completed"
         self.__events["finished"].set()
         self.__timestamps["finished_set"] = datetime.now()
+        self.__notify()
 
 
     def WaitForCompletion(self, wtime = None):
@@ -154,26 +215,59 @@ class rtevalModulePrototype(threading.Thread):
         raise NotImplementedError("_WorkloadCleanup() method must be implemented in the %s module" % self._name)
 
 
+    def _WorkloadTerminate(self):
+        """Optional module method, called when the module process is terminated as the
+module did not stop in time.  It should stop the processes the workload started,
+as _WorkloadCleanup() may be stuck"""
+        pass
+
+
     def WorkloadWillRun(self):
         "Returns True if this workload will be run"
         return self._donotrun is False
 
 
+    def LiveStatus(self):
+        "Optional module method, which may return a short text describing the results gathered so far"
+        return None
+
+
+    def LivePercentile(self, quantile):
+        """Optional module method, which may return a dictionary of (low, estimate, high)
+latency tuples for the given percentile per measured item, gathered so far.  The
+tuple of an item is None when it can't be estimated reliably, such as when samples
+were lost or when no new samples came in since the previous call"""
+        return None
+
+
+    def SetStage(self, stage, level):
+        """Optional module method, called when a staged run enters stage number stage,
+with the loads at level percent of their default intensity.  A stage of None
+means the results gathered until the next stage belong to no stage"""
+        pass
+
+
     def run(self):
         "Workload thread runner - takes care of keeping the workload running as long as needed"
         if self.shouldStop():
             return
 
-        # Initial workload setups
-        self._WorkloadSetup()
+        self.__preparestart = time.time()
+        try:
+            # Initial workload setups
+            self.__timed("setup", self._WorkloadSetup)
 
-        if not self._donotrun:
-            # Compile the workload
-            self._WorkloadBuild()
+            if not self._donotrun:
+                # Compile the workload
+                self.__timed("build", self._WorkloadBuild)
 
-            # Do final preparations of workload  before we're ready to start running
-            self._WorkloadPrepare()
+                # Do final preparations of workload  before we're ready to start running
+                self.__timed("prepare", self._WorkloadPrepare)
+        finally:
+            # Let Start() know, also if the preparations failed
+            self.__notifyReady()
 
+        if not self._donotrun:
             # Wait until we're released
             while True:
                 if self.shouldStop():
@@ -184,22 +278,29 @@ class rtevalModulePrototype(threading.Thread):
 
             self._log(Log.DEBUG, "Starting %s workload" % self._module_type)
             self.__timestamps["runloop_start"] = datetime.now()
+            nexttask = 0
             while not self.shouldStop():
                 # Run the workload
-                self._WorkloadTask()
+                if time.time() >= nexttask:
+                    self.__timed("task", self._WorkloadTask)
+                    nexttask = time.time() + self._task_interval
 
                 if self.shouldStop():
                     break
                 if not self.WorkloadAlive():
                     self._log(Log.DEBUG, "%s workload stopped running." % self._module_type)
+                    self.__notify()
                     break
-                time.sleep(60.0)
+
+                # Sleep until the next check, unless told to stop
+                self.__events["stop"].wait(min(self._poll_interval,
+                                               max(nexttask - time.time(), 0.01)))
             self.__timestamps["runloop_stop"] = datetime.now()
             self._log(Log.DEBUG, "stopping %s workload" % self._module_type)
         else:
             self._log(Log.DEBUG, "Workload was not started")
 
-        self._WorkloadCleanup()
+        self.__timed("cleanup", self._WorkloadCleanup)
 
 
     def MakeReport(self):
@@ -217,6 +318,421 @@ class rtevalModulePrototype(threading.Thread):
         return ts_n
 
 
+    def __timed(self, phase, func):
+        "Calls func() and records the time spent in it for the given phase"
+        start = time.time()
+        try:
+            return func()
+        finally:
+            self.RecordTiming(phase, time.time() - start)
+
+
+    def RecordTiming(self, phase, seconds):
+        "Adds one call of the given module phase, which took the given number of seconds"
+        if phase not in self.__timings:
+            self.__timings[phase] = [0, 0.0, seconds, seconds]
+        t = self.__timings[phase]
+        t[0] += 1
+        t[1] += seconds
+        t[2] = min(t[2], seconds)
+        t[3] = max(t[3], seconds)
+
+
+    def GetTimings(self):
+        """Returns a dictionary with the number of calls and the total, minimum and
+maximum seconds spent in each of the module phases"""
+        ret = {}
+        for (phase, (calls, total, tmin, tmax)) in self.__timings.items():
+            ret[phase] = {'calls': calls, 'total': total, 'min': tmin, 'max': tmax}
+        return ret
+
+
+    def GetTimingsReport(self):
+        "Return libxml2.xmlNode object with the time spent in each module phase"
+
+        tm_n = libxml2.newNode("timings")
+        order = ("setup", "build", "prepare", "task", "cleanup", "report")
+        phases = [p for p in order if p in self.__timings]
+        phases += sorted([p for p in self.__timings.keys() if p not in order])
+        for phase in phases:
+            (calls, total, tmin, tmax) = self.__timings[phase]
+            ph_n = tm_n.newChild(None, "phase", None)
+            ph_n.newProp("name", phase)
+            ph_n.newProp("calls", str(calls))
+            ph_n.newProp("total", "%.6f" % total)
+            ph_n.newProp("min", "%.6f" % tmin)
+            ph_n.newProp("max", "%.6f" % tmax)
+
+        return tm_n
+
+
+
+class _ProcessNotifier(object):
+    """Stands in for the wakeup event and the ready condition of a module running
+in a module process, passing set() and notifyAll() on to the parent process"""
+
+    def __init__(self, notify, msg):
+        self.__notify = notify
+        self.__msg = msg
+
+    def set(self):
+        self.__notify((self.__msg,))
+
+    def notifyAll(self):
+        self.__notify((self.__msg,))
+
+    def acquire(self):
+        pass
+
+    def release(self):
+        pass
+
+
+
+class ModuleProcess(object):
+    """Runs a module object in a child process of its own instead of a thread in the
+rteval process.  A ModuleProcess object stands in for the module object, forwarding
+the calls RtEvalModules makes over a pipe to the module in the child process.  A
+second pipe passes the ready and wakeup notifications back.  When the workload has
+completed, the reports of the module are shipped back to the parent process and the
+child process exits."""
+
+    # Calls answered from the shipped results once the module process is done
+    __results = {"isReady": "ready",
+                 "hadRuntimeError": "runtimeerror",
+                 "WorkloadWillRun": "willrun",
+                 "AbortReason": "abort",
+                 "TimeToReady": "timetoready",
+                 "GetTimings": "timings",
+                 "MakeReport": "report",
+                 "GetTimestamps": "timestamps",
+                 "GetTimingsReport": "timingsreport"}
+
+    # Calls returning libxml2.xmlNode objects, passed as serialised XML
+    __xmlcalls = ("MakeReport", "GetTimestamps", "GetTimingsReport")
+
+    def __init__(self, name, modobj, logger, nice=None):
+        self.__name = name
+        self.__mod = modobj
+        self.__logger = logger
+        self.__nice = nice and int(nice) or 0
+        self.__process = None
+        self.__cmdconn = None
+        self.__cmdlock = threading.Lock()
+        self.__listener = None
+        self.__done = threading.Event()
+        self.__result = {}
+        self.__readycond = None
+        self.__wakeup = None
+        self.__poll_interval = None
+
+
+    def __call(self, name, *args):
+        """Calls a method of the module object, in the module process when it runs
+or from the shipped results when it is done"""
+
+        if self.__process is None:
+            # Not started yet, the module object is still ours
+            return getattr(self.__mod, name)(*args)
+
+        if not self.__done.isSet():
+            self.__cmdlock.acquire()
+            try:
+                try:
+                    self.__cmdconn.send((name, args))
+                    (ok, ret) = self.__recv(self.__cmdconn)
+                except (EOFError, IOError):
+                    # The module process went away, wait for the listener to notice
+                    self.__done.wait(5.0)
+                    ok = None
+            finally:
+                self.__cmdlock.release()
+
+            if ok is False:
+                raise RuntimeError("%s() failed in the %s module process: %s" % (name, self.__name, ret))
+            if ok:
+                if ret is not None and name in self.__xmlcalls:
+                    return libxml2.parseDoc(ret).getRootElement()
+                return ret
+
+        key = self.__results.get(name)
+        if key is None or self.__result.get(key) is None:
+            return None
+        if name in self.__xmlcalls:
+            return libxml2.parseDoc(self.__result[key]).getRootElement()
+        return self.__result[key]
+
+
+    def __recv(self, conn):
+        """Receives from the module process.  Its workload processes may inherit the pipe,
+so the module process dying is not always seen as end of file"""
+        while not conn.poll(0.5):
+            if not self.__process.is_alive():
+                if conn.poll():
+                    break
+                raise EOFError("The %s module process exited" % self.__name)
+        return conn.recv()
+
+
+    def __serve(self, conn, notify):
+        "Serves the calls from the parent process, in the module process"
+        while True:
+            try:
+                (name, args) = conn.recv()
+            except (EOFError, IOError):
+                # The parent process went away, stop the workload
+                self.__mod.setStop()
+                return
+
+            try:
+                if name == "SetWakeupEvent":
+                    ret = self.__mod.SetWakeupEvent(_ProcessNotifier(notify, "wakeup"), *args)
+                else:
+                    ret = getattr(self.__mod, name)(*args)
+                    if ret is not None and name in self.__xmlcalls:
+                        ret = ret.serialize()
+                conn.send((True, ret))
+            except Exception, e:
+                conn.send((False, "%s: %s" % (e.__class__.__name__, str(e))))
+
+
+    def __child(self, cmdconn, notifyconn):
+        "Runs the module in the module process and ships the results back when done"
+        lock = threading.Lock()
+        def notify(msg):
+            lock.acquire()
+            try:
+                notifyconn.send(msg)
+            finally:
+                lock.release()
+
+        if self.__nice:
+            os.nice(self.__nice)
+
+        mod = self.__mod
+        mod.SetReadyCondition(_ProcessNotifier(notify, "ready"))
+        if self.__wakeup:
+            mod.SetWakeupEvent(_ProcessNotifier(notify, "wakeup"), self.__poll_interval)
+
+        def terminate(signum, frame):
+            # Don't leave the workload processes behind when terminated
+            try:
+                mod._WorkloadTerminate()
+            finally:
+                os._exit(128 + signum)
+        signal.signal(signal.SIGTERM, terminate)
+
+        server = threading.Thread(target=self.__serve, args=(cmdconn, notify))
+        server.daemon = True
+        server.start()
+
+        try:
+            mod.run()
+        except Exception, e:
+            mod._setRuntimeError()
+            traceback.print_exc(file=sys.stderr)
+
+        result = {"ready": mod.isReady(),
+                  "willrun": mod.WorkloadWillRun(),
+                  "abort": mod.AbortReason(),
+                  "timetoready": mod.TimeToReady()}
+        try:
+            start = time.time()
+            rep_n = mod.MakeReport()
+            mod.RecordTiming("report", time.time() - start)
+            result["report"] = rep_n and rep_n.serialize() or None
+        except Exception, e:
+            mod._setRuntimeError()
+            traceback.print_exc(file=sys.stderr)
+        result["runtimeerror"] = mod.hadRuntimeError()
+        result["timings"] = mod.GetTimings()
+        result["timestamps"] = mod.GetTimestamps().serialize()
+        result["timingsreport"] = mod.GetTimingsReport().serialize()
+        notify(("done", result))
+
+
+    def __listen(self, conn):
+        "Passes on the notifications from the module process, until it is done"
+        while True:
+            try:
+                msg = self.__recv(conn)
+            except (EOFError, IOError):
+                break
+
+            if msg[0] == "done":
+                self.__result = msg[1]
+                break
+            elif msg[0] == "ready":
+                self.__notifyReady()
+            elif msg[0] == "wakeup" and self.__wakeup:
+                self.__wakeup.set()
+
+        if not self.__result:
+            self.__logger.log(Log.ERR, "The %s module process died (exit code %s)"
+                              % (self.__name, self.__process.exitcode))
+            self.__result = {"runtimeerror": True}
+        self.__done.set()
+        self.__notifyReady()
+        if self.__wakeup:
+            self.__wakeup.set()
+
+
+    def __notifyReady(self):
+        if self.__readycond:
+            self.__readycond.acquire()
+            self.__readycond.notifyAll()
+            self.__readycond.release()
+
+
+    def start(self):
+        "Starts the module process"
+        (self.__cmdconn, childcmd) = multiprocessing.Pipe()
+        (notifyconn, childnotify) = multiprocessing.Pipe(False)
+        self.__process = multiprocessing.Process(target=self.__child,
+                                                 name="rteval-%s" % self.__name,
+                                                 args=(childcmd, childnotify))
+        self.__process.start()
+        childnotify.close()
+        self.__logger.log(Log.DEBUG, "Started the %s module process (pid %i)"
+                          % (self.__name, self.__process.pid))
+
+        self.__listener = threading.Thread(target=self.__listen, args=(notifyconn,))
+        self.__listener.daemon = True
+        self.__listener.start()
+
+
+    def is_alive(self):
+        "Returns True while the module process runs the module"
+        return self.__process is not None and not self.__done.isSet()
+
+
+    def join(self, timeout=None):
+        "Waits for the module process to complete and to exit"
+        if self.__process is None:
+            return
+        self.__done.wait(timeout)
+        if self.__done.isSet():
+            self.__process.join(timeout)
+
+
+    def terminate(self, timeout=15.0):
+        """Terminates the module process with SIGTERM, and with SIGKILL if it still
+runs timeout seconds later.  On SIGTERM, the module stops the processes of its
+workload, which takes up to kill_timeout seconds for a load.  The results of
+the module are lost"""
+        if self.__process is None or not self.__process.is_alive():
+            return
+        self.__process.terminate()
+        self.__process.join(timeout)
+        if self.__process.is_alive():
+            self.__logger.log(Log.WARN, "Killing the %s module process (pid %i)"
+                              % (self.__name, self.__process.pid))
+            os.kill(self.__process.pid, signal.SIGKILL)
+            self.__process.join(timeout)
+        self.__done.wait(timeout)
+
+
+    def SetReadyCondition(self, cond):
+        self.__readycond = cond
+
+
+    def SetWakeupEvent(self, event, poll_interval=None):
+        self.__wakeup = event
+        if poll_interval:
+            self.__poll_interval = poll_interval
+        if self.__process is not None:
+            self.__call("SetWakeupEvent", poll_interval)
+
+
+    def WaitForCompletion(self, wtime = None):
+        if self.__process is None:
+            return self.__mod.WaitForCompletion(wtime)
+        if not self.__call("shouldStart"):
+            return None
+        return self.__done.wait(wtime)
+
+
+    def isReady(self):
+        return self.__call("isReady")
+
+
+    def hadRuntimeError(self):
+        return self.__call("hadRuntimeError")
+
+
+    def WorkloadWillRun(self):
+        return self.__call("WorkloadWillRun")
+
+
+    def WorkloadAlive(self):
+        return bool(self.__call("WorkloadAlive"))
+
+
+    def Prewarm(self):
+        # Prewarming happens instead of a run, in the rteval process
+        return self.__mod.Prewarm()
+
+
+    def setStart(self):
+        return self.__call("setStart")
+
+
+    def setStop(self):
+        return self.__call("setStop")
+
+
+    def SetIntensity(self, intensity):
+        return self.__call("SetIntensity", intensity)
+
+
+    def AbortReason(self):
+        return self.__call("AbortReason")
+
+
+    def TimeToReady(self):
+        return self.__call("TimeToReady")
+
+
+    def LiveStatus(self):
+        return self.__call("LiveStatus")
+
+
+    def LivePercentile(self, quantile):
+        return self.__call("LivePercentile", quantile)
+
+
+    def SetStage(self, stage, level):
+        return self.__call("SetStage", stage, level)
+
+
+    def MakeReport(self):
+        return self.__call("MakeReport")
+
+
+    def GetTimestamps(self):
+        return self.__call("GetTimestamps")
+
+
+    def RecordTiming(self, phase, seconds):
+        # Once done, the report phase was already timed in the module process
+        return self.__call("RecordTiming", phase, seconds)
+
+
+    def GetTimings(self):
+        return self.__call("GetTimings")
+
+
+    def GetTimingsReport(self):
+        return self.__call("GetTimingsReport")
+
+
+
+def parse_bool(value):
+    """Returns the value of a boolean module parameter, which is a string such as
+'1', 'yes' or 'on' when given on the command line or in the configuration file"""
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
 
 class ModuleContainer(object):
     """The ModuleContainer keeps an overview over loaded modules and the objects it
@@ -388,6 +904,7 @@ and will also be given to the instantiated objects during module import."""
         self._logger = logger
         self.__modules = ModuleContainer(modules_root, logger)
         self.__timestamps = {}
+        self.__readycond = threading.Condition()
 
 
     # Export some of the internal module container methods
@@ -398,8 +915,18 @@ and will also be given to the instantiated objects during module import."""
         return self.__modules.ImportModule(module)
 
     def _InstantiateModule(self, modname, modcfg, modroot = None):
-        "Imports a module and returns an instantiated object from the module"
-        return self.__modules.InstantiateModule(modname, modcfg, modroot)
+        """Imports a module and returns an instantiated object from the module, wrapped
+in a ModuleProcess() object if the module is configured to run in a process of its own"""
+        modobj = self.__modules.InstantiateModule(modname, modcfg, modroot)
+
+        backend = modcfg and modcfg.setdefault('backend', None)
+        if not backend:
+            backend = self._cfg.GetSection('rteval').setdefault('module_backend', 'thread')
+        if backend == 'process':
+            return ModuleProcess(modname, modobj, self._logger, modcfg and modcfg.setdefault('nice', None))
+        elif backend != 'thread':
+            raise ValueError("Unknown backend for the %s module: %s" % (modname, backend))
+        return modobj
 
     def _RegisterModuleObject(self, modname, modobj):
         "Registers an instantiated module object which RtEvalModules will control"
@@ -435,29 +962,60 @@ start their workloads yet"""
             raise rtevalRuntimeError("No %s modules configured" % self._module_type)
 
         self._logger.log(Log.INFO, "Preparing %s modules" % self._module_type)
+        started = time.time()
         for (modname, mod) in self.__modules:
+            mod.SetReadyCondition(self.__readycond)
             mod.start()
             if mod.WorkloadWillRun():
                 self._logger.log(Log.DEBUG, "\t - Started %s preparations" % modname)
 
         self._logger.log(Log.DEBUG, "Waiting for all %s modules to get ready" % self._module_type)
-        busy = True
-        while busy:
-            busy = False
-            for (modname, mod) in self.__modules:
-                if not mod.isReady():
-                    if not mod.hadRuntimeError():
-                        busy = True
-                        self._logger.log(Log.DEBUG, "Waiting for %s" % modname)
-                    else:
+        self.__readycond.acquire()
+        try:
+            waitingfor = None
+            while True:
+                busy = []
+                timeout = None
+                for (modname, mod) in self.__modules:
+                    if mod.isReady():
+                        continue
+                    if mod.hadRuntimeError():
                         raise RuntimeError("Runtime error starting the %s %s module" % (modname, self._module_type))
+                    if not mod.is_alive():
+                        raise RuntimeError("The %s %s module stopped while getting ready" % (modname, self._module_type))
+
+                    # Seconds left before the module times out
+                    left = self.__ready_timeout(modname) - (time.time() - started)
+                    if left <= 0:
+                        raise RuntimeError("The %s %s module did not get ready within %g seconds"
+                                           % (modname, self._module_type, self.__ready_timeout(modname)))
+                    timeout = min(timeout or left, left)
+                    busy.append(modname)
+
+                if not busy:
+                    break
+                if busy != waitingfor:
+                    self._logger.log(Log.DEBUG, "Waiting for %s" % ", ".join(busy))
+                    waitingfor = busy
+                self.__readycond.wait(timeout)
+        finally:
+            self.__readycond.release()
 
-            if busy:
-                time.sleep(1)
-
+        for (modname, mod) in self.__modules:
+            if mod.TimeToReady() is not None:
+                self._logger.log(Log.DEBUG, "\t - %s was ready after %.1f seconds" % (modname, mod.TimeToReady()))
         self._logger.log(Log.DEBUG, "All %s modules are ready" % self._module_type)
 
 
+    def __ready_timeout(self, modname):
+        "Returns the number of seconds the named module may spend getting ready"
+        try:
+            timeout = self._cfg.GetSection(modname).setdefault('ready_timeout', None)
+        except KeyError:
+            timeout = None
+        return float(timeout or self._cfg.GetSection('rteval').setdefault('ready_timeout', 1800))
+
+
     def hadError(self):
         "Returns True if one or more modules had a RuntimeError"
         return self.__runtimeError
@@ -477,6 +1035,15 @@ start their workloads yet"""
         return nthreads
 
 
+    def GetDeadModules(self):
+        """Returns the names of the modules which no longer run their workload, while
+they should.  This works for both the thread and the process backends, as a
+module process which died reports a runtime error"""
+        return [modname for (modname, mod) in self.__modules
+                if mod.hadRuntimeError()
+                or (mod.WorkloadWillRun() and not (mod.is_alive() and mod.WorkloadAlive()))]
+
+
     def _isAlive(self):
         """Returns True if all modules are running"""
 
@@ -494,15 +1061,31 @@ start their workloads yet"""
             raise RuntimeError("No %s modules configured" % self._module_type)
 
         self._logger.log(Log.INFO, "Stopping %s modules" % self._module_type)
+
+        # Tell all the modules to stop first, so they clean up in parallel
+        stopping = []
         for (modname, mod) in self.__modules:
             if not mod.WorkloadWillRun():
                 continue
-
+            self._logger.log(Log.DEBUG, "\t - Stopping %s" % modname)
             mod.setStop()
+            stopping.append((modname, mod))
+
+        # Measurement modules get longer, to reduce and report their results
+        if self._module_type == 'measurement':
+            timeout = self._cfg.GetSection('rteval').setdefault('measure_stop_timeout', 300)
+        else:
+            timeout = self._cfg.GetSection('rteval').setdefault('stop_timeout', 15)
+        deadline = time.time() + float(timeout)
+        for (modname, mod) in stopping:
             try:
-                self._logger.log(Log.DEBUG, "\t - Stopping %s" % modname)
                 if mod.is_alive():
-                    mod.join(2.0)
+                    mod.join(max(deadline - time.time(), 0.0))
+                if mod.is_alive() and isinstance(mod, ModuleProcess):
+                    self._logger.log(Log.WARN, "\t\t%s did not stop in time, terminating it" % modname)
+                    mod.terminate()
+                elif mod.is_alive():
+                    self._logger.log(Log.WARN, "\t\t%s did not stop in time" % modname)
             except RuntimeError, e:
                 self._logger.log(Log.ERR, "\t\tFailed stopping %s: %s" % (modname, str(e)))
         self.__timestamps['stop'] = datetime.now()
@@ -518,6 +1101,54 @@ start their workloads yet"""
         self._logger.log(Log.DEBUG, "All %s modules completed" % self._module_type)
 
 
+    def GetLiveStatus(self):
+        """Returns a list of (module name, status text) tuples for the modules which
+can tell something about their workload while it is running"""
+
+        ret = []
+        for (modname, mod) in self.__modules:
+            status = mod.LiveStatus()
+            if status:
+                ret.append((modname, status))
+        return ret
+
+
+    def SetStage(self, stage, level):
+        "Tells all the modules a new stage of a staged run started, see rtevalModulePrototype.SetStage()"
+        for (modname, mod) in self.__modules:
+            mod.SetStage(stage, level)
+
+
+    def SetWakeupEvent(self, event, poll_interval=None):
+        "Sets the event all the modules will set when they finish, fail or request an abort"
+        for (modname, mod) in self.__modules:
+            mod.SetWakeupEvent(event, poll_interval)
+
+
+    def GetLivePercentiles(self, quantile):
+        """Returns a list of (module name, percentiles) tuples for the modules which
+can estimate the given percentile while running, see LivePercentile()"""
+
+        ret = []
+        for (modname, mod) in self.__modules:
+            pct = mod.LivePercentile(quantile)
+            if pct:
+                ret.append((modname, pct))
+        return ret
+
+
+    def GetAbortReasons(self):
+        """Returns a list of (module name, reason) tuples for the modules which
+requested the run to be aborted"""
+
+        ret = []
+        for (modname, mod) in self.__modules:
+            reason = mod.AbortReason()
+            if reason:
+                ret.append((modname, reason))
+        return ret
+
+
     def MakeReport(self):
         """Collects all the loaded modules reports in a single libxml2.xmlNode() object"""
 
@@ -525,13 +1156,26 @@ start their workloads yet"""
 
         for (modname, mod) in self.__modules:
             self._logger.log(Log.DEBUG, "Getting report from %s" % modname)
+            start = time.time()
             modrep_n = mod.MakeReport()
+            mod.RecordTiming("report", time.time() - start)
             if modrep_n is not None:
+                if mod.TimeToReady() is not None:
+                    modrep_n.newProp("time_to_ready", "%.3f" % mod.TimeToReady())
                 if self._module_type != 'load':
                     # Currently the <loads/> tag will not easily integrate
                     # timestamps. Not sure it makes sense to track this on
                     # load modules.
                     modrep_n.addChild(mod.GetTimestamps())
+                modrep_n.addChild(mod.GetTimingsReport())
                 rep_n.addChild(modrep_n)
 
         return rep_n
+
+
+    def GetTimings(self):
+        "Returns a dictionary with the phase timings of each module, see rtevalModulePrototype.GetTimings()"
+        ret = {}
+        for (modname, mod) in self.__modules:
+            ret[modname] = mod.GetTimings()
+        return ret
@@ -25,12 +25,18 @@
 
 import os
 import time
+import errno
 import threading
+import subprocess
 import libxml2
+import schedutils
+from signal import SIGTERM, SIGKILL
 from rteval.Log import Log
 from rteval.rtevalConfig import rtevalCfgSection
 from rteval.modules import RtEvalModules, rtevalModulePrototype
 from rteval.sysinfo.tools import chown
+from rteval.sysinfo.cputopology import parse_cpulist
+from rteval.sysinfo.cpuload import CpuLoadSampler, read_loadavg
 
 class LoadThread(rtevalModulePrototype):
     def __init__(self, name, config, logger=None):
@@ -51,8 +57,20 @@ class LoadThread(rtevalModulePrototype):
         self.source = config.setdefault('source', None)
         self.reportdir = config.setdefault('reportdir', os.getcwd())
         self.memsize = config.setdefault('memsize', (0, 'GB'))
+        self.cpulist = config.setdefault('housekeeping_cpulist', None)
         self._logging = config.setdefault('logging', True)
+        # Seconds the load processes get to stop on SIGTERM, before SIGKILL
+        self.kill_timeout = float(config.setdefault('kill_timeout', 5))
         self._cfg = config
+        # metric -> [count, seconds, min, max] of the work the load completed
+        self.__throughput = {}
+        self.__throughput_lock = threading.Lock()
+        self.__started = None
+        self.__stopped = None
+        # Multiplier of the number of instances or jobs, set by the load controller
+        self.__intensity = 1.0
+        # The processes started by start_process() which may still run
+        self.__procs = []
         self.mydir = None
         self.jobs = 0
         self.args = None
@@ -61,6 +79,107 @@ class LoadThread(rtevalModulePrototype):
             os.makedirs(self.builddir)
 
 
+    def run(self):
+        if self.cpulist:
+            # Pin the load thread to the housekeeping CPUs, which
+            # all the load processes it starts will inherit
+            self._log(Log.DEBUG, "running on CPUs %s" % self.cpulist)
+            schedutils.set_affinity(0, parse_cpulist(self.cpulist))
+        rtevalModulePrototype.run(self)
+
+
+    def setStart(self):
+        self.__started = time.time()
+        rtevalModulePrototype.setStart(self)
+
+
+    def setStop(self):
+        if self.__started and not self.__stopped:
+            self.__stopped = time.time()
+        rtevalModulePrototype.setStop(self)
+
+
+    def SetIntensity(self, intensity):
+        """Scales the load by intensity, a multiplier of the number of instances or
+jobs it was configured to run.  The load applies it when it starts instances"""
+        self.__intensity = float(intensity)
+
+
+    def _scaled(self, count):
+        """Returns count scaled by the load intensity, as a whole number of at least 1.
+Returns 0 when the intensity is 0, where the load should not run at all"""
+        if self.__intensity <= 0:
+            return 0
+        return max(int(round(float(count) * self.__intensity)), 1)
+
+
+    def _addThroughput(self, metric, count=1, seconds=None):
+        """Records count units of work the load completed, such as iterations or builds,
+optionally with the seconds it took to complete one of them"""
+        self.__throughput_lock.acquire()
+        try:
+            if metric not in self.__throughput:
+                self.__throughput[metric] = [0, 0.0, None, None]
+            t = self.__throughput[metric]
+            t[0] += count
+            if seconds is not None:
+                t[1] += seconds
+                if t[2] is None or seconds < t[2]:
+                    t[2] = seconds
+                if t[3] is None or seconds > t[3]:
+                    t[3] = seconds
+        finally:
+            self.__throughput_lock.release()
+
+
+    def GetThroughput(self):
+        """Returns a dictionary with the count and rate per second of each throughput
+metric, and the mean, minimum and maximum seconds per unit when they were timed"""
+        if not self.__started:
+            return {}
+        duration = (self.__stopped or time.time()) - self.__started
+
+        ret = {}
+        self.__throughput_lock.acquire()
+        try:
+            for (metric, (count, seconds, tmin, tmax)) in self.__throughput.items():
+                ret[metric] = {'count': count,
+                               'rate': duration > 0 and count / duration or 0.0}
+                if tmin is not None:
+                    ret[metric].update({'mean': seconds / count, 'min': tmin, 'max': tmax})
+        finally:
+            self.__throughput_lock.release()
+        return ret
+
+
+    def MakeThroughputReport(self):
+        "Return libxml2.xmlNode object with the throughput the load delivered"
+        tp_n = libxml2.newNode("throughput")
+        if self.__started:
+            tp_n.newProp("duration", "%.3f" % ((self.__stopped or time.time()) - self.__started))
+
+        throughput = self.GetThroughput()
+        for metric in sorted(throughput.keys()):
+            t = throughput[metric]
+            m_n = tp_n.newChild(None, "metric", None)
+            m_n.newProp("name", metric)
+            m_n.newProp("count", str(t['count']))
+            m_n.newProp("rate", "%.6f" % t['rate'])
+            if 'mean' in t:
+                m_n.newProp("mean", "%.6f" % t['mean'])
+                m_n.newProp("min", "%.6f" % t['min'])
+                m_n.newProp("max", "%.6f" % t['max'])
+        return tp_n
+
+
+    def Prewarm(self):
+        """Sets up and builds the load ahead of a run without running it, for the
+loads to cache the results of their build for later runs"""
+        self._WorkloadSetup()
+        if not self._donotrun:
+            self._WorkloadBuild()
+
+
     def open_logfile(self, name):
         logfilepath = os.path.join(self.reportdir, "logs", name)
         logfile = os.open(logfilepath, os.O_CREAT|os.O_WRONLY)
@@ -68,6 +187,75 @@ class LoadThread(rtevalModulePrototype):
         return logfile
 
 
+    def start_process(self, args, **kwargs):
+        """Starts a load process with subprocess.Popen() in a session and process group
+of its own, so stop_process() can stop it together with all the processes it started"""
+        preexec = kwargs.pop('preexec_fn', None)
+        def setsid():
+            os.setsid()
+            if preexec:
+                preexec()
+
+        proc = subprocess.Popen(args, preexec_fn=setsid, **kwargs)
+        self.__procs = [p for p in self.__procs if p.poll() is None] + [proc]
+        return proc
+
+
+    def __group_alive(self, proc):
+        """Returns True while any process is left running in the process group of proc.
+Zombies are not counted, as they wait for their parent or init to reap them"""
+        proc.poll()
+        for pid in os.listdir('/proc'):
+            if not pid.isdigit():
+                continue
+            try:
+                fp = open(os.path.join('/proc', pid, 'stat'), 'r')
+                stat = fp.readline()
+                fp.close()
+            except IOError:
+                # The process exited meanwhile
+                continue
+            # The command name may contain spaces, the fields after it do not
+            fields = stat[stat.rindex(')') + 2:].split()
+            if int(fields[2]) == proc.pid and fields[0] != 'Z':
+                return True
+        return False
+
+
+    def stop_process(self, proc):
+        """Stops the process group of a process started by start_process(), with
+SIGTERM first and with SIGKILL if it is still running after kill_timeout seconds"""
+        if proc is None:
+            return
+
+        for (sig, timeout) in ((SIGTERM, self.kill_timeout), (SIGKILL, 5.0)):
+            if not self.__group_alive(proc):
+                break
+            self._log(Log.DEBUG, "sending %s to process group %d"
+                      % (sig == SIGTERM and "SIGTERM" or "SIGKILL", proc.pid))
+            try:
+                os.killpg(proc.pid, sig)
+            except OSError, e:
+                if e.errno != errno.ESRCH:
+                    raise
+            deadline = time.time() + timeout
+            while self.__group_alive(proc) and time.time() < deadline:
+                time.sleep(0.05)
+
+        if self.__group_alive(proc):
+            self._log(Log.WARN, "process group %d did not stop" % proc.pid)
+        else:
+            proc.wait()
+            if proc in self.__procs:
+                self.__procs.remove(proc)
+
+
+    def _WorkloadTerminate(self):
+        "Stops the process groups of all the load processes which may still run"
+        for proc in list(self.__procs):
+            self.stop_process(proc)
+
+
 class CommandLineLoad(LoadThread):
     def __init__(self, name, config, logger):
         LoadThread.__init__(self, name, config, logger)
@@ -85,9 +273,99 @@ class CommandLineLoad(LoadThread):
             if self.args:
                 rep_n.addContent(" ".join(self.args))
 
+        rep_n.addChild(self.MakeThroughputReport())
         return rep_n
 
 
+class LoadController(object):
+    """Closed loop controller of the load intensity.  After each sample of the CPU
+load sampler, it compares the mean utilisation of the load CPUs, or the number
+of runnable processes per load CPU, with a target.  Every interval seconds a PID
+control loop turns the mean error since the previous step into the intensity of
+the loads, between the given limits"""
+
+    def __init__(self, loadmods, metric, target, cpus=None, interval=5.0,
+                 gains=(1.0, 0.05, 0.0), limits=(0.1, 4.0)):
+        if metric not in ('util', 'runqueue'):
+            raise ValueError("Unknown load control metric: %s" % metric)
+        self.__loadmods = loadmods
+        self.__metric = metric
+        self.__target = float(target)
+        if self.__target <= 0:
+            raise ValueError("The load control target must be positive: %s" % target)
+        self.__cpus = cpus
+        self.__interval = float(interval)
+        (self.__kp, self.__ki, self.__kd) = [float(g) for g in gains]
+        (self.__min, self.__max) = [float(l) for l in limits]
+        self.__started = time.time()
+        self.__nextstep = self.__started + self.__interval
+        self.__window = []
+        self.__integral = 0.0
+        self.__preverror = None
+        self.__intensity = 1.0
+        # (offset, measured, error, intensity) of each control step
+        self.__trajectory = []
+
+
+    def sample(self, now, util, running):
+        "Takes a sample of the CPU load sampler, see CpuLoadSampler.AddListener()"
+        cpus = [c for c in (self.__cpus or util.keys()) if c in util]
+        if not cpus:
+            return
+        if self.__metric == 'util':
+            self.__window.append(float(sum([util[c] for c in cpus])) / len(cpus))
+        else:
+            self.__window.append(float(running) / len(cpus))
+
+        if now >= self.__nextstep:
+            self.__nextstep += self.__interval
+            self.__step(now, sum(self.__window) / len(self.__window))
+            self.__window = []
+
+
+    def __step(self, now, measured):
+        "Sets the load intensity from the error of the measured value"
+        error = (self.__target - measured) / (self.__metric == 'util' and 100.0 or self.__target)
+        integral = self.__integral + error * self.__interval
+        derivative = 0.0
+        if self.__preverror is not None:
+            derivative = (error - self.__preverror) / self.__interval
+        self.__preverror = error
+
+        output = 1.0 + self.__kp * error + self.__ki * integral + self.__kd * derivative
+        self.__intensity = min(max(output, self.__min), self.__max)
+        if self.__intensity == output:
+            # Only integrate while not saturated, to not wind up
+            self.__integral = integral
+
+        self.__trajectory.append((now - self.__started, measured, error, self.__intensity))
+        self.__loadmods.SetIntensity(self.__intensity)
+
+
+    def GetTrajectory(self):
+        "Returns a list of the (offset, measured, error, intensity) of each control step"
+        return list(self.__trajectory)
+
+
+    def MakeReport(self):
+        rep_n = libxml2.newNode("loadcontrol")
+        rep_n.newProp("metric", self.__metric)
+        rep_n.newProp("target", "%g" % self.__target)
+        rep_n.newProp("interval", "%g" % self.__interval)
+        rep_n.newProp("kp", "%g" % self.__kp)
+        rep_n.newProp("ki", "%g" % self.__ki)
+        rep_n.newProp("kd", "%g" % self.__kd)
+        rep_n.newProp("intensity", "%.3f" % self.__intensity)
+        for (offset, measured, error, intensity) in self.__trajectory:
+            step_n = rep_n.newChild(None, "step", None)
+            step_n.newProp("offset", "%.1f" % offset)
+            step_n.newProp("measured", "%.2f" % measured)
+            step_n.newProp("error", "%.4f" % error)
+            step_n.newProp("intensity", "%.3f" % intensity)
+        return rep_n
+
+
+
 class LoadModules(RtEvalModules):
     """Module container for LoadThread based modules"""
 
@@ -95,8 +373,12 @@ class LoadModules(RtEvalModules):
         self._module_type = "load"
         self._module_config = "loads"
         self._report_tag = "loads"
-        self.__loadavg_accum = 0.0
-        self.__loadavg_samples = 0
+        self.__sampler = None
+        self.__controller = None
+        # The intensity last set, None while the loads run at their default
+        self.__intensity = None
+        self.__cpugroups = []
+        self.__loadcpus = None
         RtEvalModules.__init__(self, config, "modules.loads", logger)
         self.__LoadModules(self._cfg.GetSection(self._module_config))
 
@@ -115,6 +397,14 @@ class LoadModules(RtEvalModules):
         if not isinstance(modparams, dict):
             raise TypeError("modparams attribute is not of a dictionary type")
 
+        # The CPU groups the CPU load sampler reports on
+        self.__cpugroups = [(name, modparams[key])
+                            for (name, key) in (('measure', 'measure_cpulist'),
+                                                ('housekeeping', 'housekeeping_cpulist'))
+                            if modparams.get(key)]
+        if modparams.get('housekeeping_cpulist'):
+            self.__loadcpus = parse_cpulist(modparams['housekeeping_cpulist'])
+
         modcfg = self._cfg.GetSection(self._module_config)
         for m in modcfg:
             # hope to eventually have different kinds but module is only on
@@ -125,24 +415,217 @@ class LoadModules(RtEvalModules):
                 self._RegisterModuleObject(m[0], modobj)
 
 
+    def Prewarm(self):
+        "Sets up and builds all the load modules without running them"
+        self._logger.log(Log.INFO, "Prewarming load modules")
+        for modname in self.GetModulesList():
+            self._logger.log(Log.DEBUG, "\t - Prewarming %s" % modname)
+            self.GetNamedModuleObject(modname).Prewarm()
+
+
+    def Start(self):
+        RtEvalModules.Start(self)
+
+        # Sample the CPU utilisation and load average while the loads run
+        rtevcfg = self._cfg.GetSection('rteval')
+        self.__sampler = CpuLoadSampler(rtevcfg.setdefault('cpuload_interval', 1),
+                                        rtevcfg.setdefault('cpuload_buffer', 3600),
+                                        self.__cpugroups, self._logger)
+        self.__sampler.start()
+
+
+    def Unleash(self):
+        nthreads = RtEvalModules.Unleash(self)
+
+        # Control the load intensity from the samples taken while the loads run
+        rtevcfg = self._cfg.GetSection('rteval')
+        target = rtevcfg.setdefault('load_target', None)
+        metric = rtevcfg.setdefault('load_metric', None) or 'util'
+        if target and self.__sampler:
+            self.__controller = LoadController(self, metric, target, self.__loadcpus,
+                                               rtevcfg.setdefault('load_control_interval', 5),
+                                               (rtevcfg.setdefault('load_kp', 1.0),
+                                                rtevcfg.setdefault('load_ki', 0.05),
+                                                rtevcfg.setdefault('load_kd', 0.0)),
+                                               (rtevcfg.setdefault('load_min_intensity', 0.1),
+                                                rtevcfg.setdefault('load_max_intensity', 4.0)))
+            self._logger.log(Log.INFO, "Controlling the load intensity for a %s of %s"
+                             % (metric, target))
+            self.__sampler.AddListener(self.__controller.sample)
+        return nthreads
+
+
+    def SetIntensity(self, intensity):
+        "Sets the intensity of all the load modules, see LoadThread.SetIntensity()"
+        self._logger.log(Log.DEBUG, "Setting the load intensity to %.3f" % intensity)
+        self.__intensity = intensity
+        for modname in self.GetModulesList():
+            self.GetNamedModuleObject(modname).SetIntensity(intensity)
+
+
+    def GetIntensity(self):
+        "Returns the load intensity last set by a staged run or the controller, or None"
+        return self.__intensity
+
+
+    def Stop(self):
+        if self.__sampler:
+            self.__sampler.stop()
+        RtEvalModules.Stop(self)
+
+
     def MakeReport(self):
         rep_n = RtEvalModules.MakeReport(self)
         rep_n.newProp("load_average", str(self.GetLoadAvg()))
+        if self.__sampler:
+            rep_n.addChild(self.__sampler.MakeReport())
+        if self.__controller:
+            rep_n.addChild(self.__controller.MakeReport())
 
         return rep_n
 
 
-    def SaveLoadAvg(self):
-        # open the loadavg /proc entry
-        p = open("/proc/loadavg")
-        load = float(p.readline().split()[0])
-        p.close()
-        self.__loadavg_accum += load
-        self.__loadavg_samples += 1
-
-
     def GetLoadAvg(self):
-        if self.__loadavg_samples == 0:
-            self.SaveLoadAvg()
-        return float(self.__loadavg_accum / self.__loadavg_samples)
-
+        "Returns the mean load average sampled while the loads ran"
+        load = self.__sampler and self.__sampler.GetLoadAvg()
+        if load is None:
+            load = read_loadavg()
+        return float(load)
+
+
+
+
+def unit_test(rootdir):
+    class Loads(object):
+        "Stands in for LoadModules, recording the intensity set by the controller"
+        def __init__(self):
+            self.intensity = 1.0
+        def SetIntensity(self, intensity):
+            self.intensity = intensity
+
+    def control(ctl, loads, plant, seconds):
+        """Feeds the controller one sample a second for the given number of seconds,
+of a plant turning the load intensity into the utilisation of CPUs 0-3 and the
+number of runnable processes.  CPU 4 is not a load CPU and is kept busy"""
+        for i in range(seconds):
+            (util, running) = plant(loads.intensity)
+            util = dict([(c, util) for c in range(4)] + [(4, 100)])
+            ctl.sample(ctl.now, util, running)
+            ctl.now += 1.0
+
+    def controller(metric, target, limits=(0.1, 4.0)):
+        loads = Loads()
+        # Samples are taken half a second after each full second
+        now = time.time() + 0.5
+        ctl = LoadController(loads, metric, target, cpus=[0, 1, 2, 3], limits=limits)
+        ctl.now = now + 1.0
+        return (ctl, loads)
+
+    try:
+        # A plant where the utilisation is 40% per unit of intensity settles
+        # at an intensity of 2 for a target of 80%
+        (ctl, loads) = controller('util', 80)
+        control(ctl, loads, lambda i: (min(40 * i, 100), 0), 300)
+        if abs(loads.intensity - 2.0) > 0.02 or abs(ctl.GetTrajectory()[-1][1] - 80) > 1:
+            print "** Utilisation control did not settle: %s" % str(ctl.GetTrajectory()[-1])
+            return 1
+        print "Utilisation control: OK"
+
+        # The runqueue metric ignores the utilisation, and counts the runnable
+        # processes per load CPU
+        (ctl, loads) = controller('runqueue', 1.5)
+        control(ctl, loads, lambda i: (100, 2 * i), 600)
+        if abs(loads.intensity - 3.0) > 0.03:
+            print "** Runqueue control did not settle: %s" % str(ctl.GetTrajectory()[-1])
+            return 1
+        print "Runqueue control: OK"
+
+        # An unreachable target saturates at the limit, without winding up the
+        # integral: once the target can be reached, it leaves the limit at once
+        (ctl, loads) = controller('util', 90)
+        control(ctl, loads, lambda i: (10 * i, 0), 500)
+        if max([s[3] for s in ctl.GetTrajectory()]) > 4.0 or loads.intensity != 4.0:
+            print "** Saturated control exceeded the limit: %s" % str(ctl.GetTrajectory())
+            return 1
+        control(ctl, loads, lambda i: (min(40 * i, 100), 0), 10)
+        if loads.intensity >= 4.0:
+            print "** Saturated control wound up: %s" % str(ctl.GetTrajectory()[-3:])
+            return 1
+        control(ctl, loads, lambda i: (min(40 * i, 100), 0), 600)
+        if abs(loads.intensity - 2.25) > 0.02:
+            print "** Control did not settle after saturation: %s" % str(ctl.GetTrajectory()[-1])
+            return 1
+        print "Saturation: OK"
+
+        # A system kept busy by something else does not lower the load below
+        # the minimum intensity
+        (ctl, loads) = controller('util', 10)
+        control(ctl, loads, lambda i: (100, 0), 100)
+        if loads.intensity != 0.1 or min([s[3] for s in ctl.GetTrajectory()]) < 0.1:
+            print "** Control was not clamped at the minimum: %s" % str(ctl.GetTrajectory())
+            return 1
+        print "Clamping: OK"
+
+        # One step per interval, all of them in the report
+        traj = ctl.GetTrajectory()
+        if len(traj) != 20 or [int(round(s[0])) for s in traj] != range(5, 101, 5):
+            print "** Unexpected control steps: %s" % str([s[0] for s in traj])
+            return 1
+        rep = ctl.MakeReport().serialize()
+        if rep.count('<step ') != len(traj) or 'intensity="0.100"' not in rep:
+            print "** Unexpected load control report: %s" % rep
+            return 1
+        print "Trajectory report: OK"
+
+        for (metric, target) in (('load', 50), ('util', 0)):
+            try:
+                LoadController(Loads(), metric, target)
+                print "** Accepted a %s target of %s" % (metric, target)
+                return 1
+            except ValueError:
+                pass
+        print "Parameter checks: OK"
+
+        # Stopping a process group which ignores SIGTERM, where the members
+        # report their pids.  The group leader is the shell
+        def running(pid):
+            try:
+                fp = open('/proc/%d/stat' % pid, 'r')
+                stat = fp.readline()
+                fp.close()
+            except IOError:
+                return False
+            return stat[stat.rindex(')') + 2] != 'Z'
+
+        import tempfile, shutil
+        tmpdir = tempfile.mkdtemp()
+        try:
+            load = LoadThread('unittest', rtevalCfgSection({'builddir': tmpdir,
+                                                            'logging': False,
+                                                            'kill_timeout': 0.5}), Log())
+            load.stop_process(None)
+            for (trap, signo) in (('trap "" TERM; ', SIGKILL), ('', SIGTERM)):
+                proc = load.start_process(['sh', '-c', trap + 'sleep 60 & echo $!; '
+                                           + 'sleep 60 & echo $!; echo $$; wait'],
+                                          stdout=subprocess.PIPE)
+                pids = [int(proc.stdout.readline()) for i in range(3)]
+                if pids[2] != proc.pid or os.getpgid(pids[0]) != proc.pid \
+                        or not load._LoadThread__group_alive(proc):
+                    print "** Process group %d not started: %s" % (proc.pid, str(pids))
+                    return 1
+                start = time.time()
+                load.stop_process(proc)
+                took = time.time() - start
+                if [p for p in pids if running(p)] or load._LoadThread__group_alive(proc):
+                    print "** Process group members left running: %s" % str([p for p in pids if running(p)])
+                    return 1
+                if proc.returncode != -signo or (signo == SIGKILL) != (took >= 0.5):
+                    print "** Process group %d stopped by %d after %.2fs" % (proc.pid, -proc.returncode, took)
+                    return 1
+        finally:
+            shutil.rmtree(tmpdir)
+        print "Process group stop: OK"
+        return 0
+    except Exception, e:
+        print "** EXCEPTION %s", str(e)
+        return 1
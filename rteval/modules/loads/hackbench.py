@@ -25,8 +25,8 @@
 #   are deemed to be part of the source code.
 #
 
-import sys, os, time, glob, subprocess, errno
-from signal import SIGKILL
+import sys, os, time, glob, subprocess, errno, threading
+from rteval.modules import parse_bool
 from rteval.modules.loads import CommandLineLoad
 from rteval.Log import Log
 
@@ -62,6 +62,15 @@ class Hackbench(CommandLineLoad):
                      ]
         self.__err_sleep = 5.0
 
+        # In continuous mode, a worker thread keeps hackbench running back to back
+        self.__continuous = parse_bool(self._cfg.setdefault('continuous', False))
+        if self._cfg.setdefault('load_ramp', None) and not self.__continuous:
+            # Follow the load levels of a staged run without delay
+            self._log(Log.DEBUG, "running continuously for the load stages")
+            self.__continuous = True
+        self.__worker = None
+        self.__hbproc = None
+
 
     def _WorkloadBuild(self):
         # Nothing to build, so we're basically ready
@@ -83,13 +92,25 @@ class Hackbench(CommandLineLoad):
         if self.shouldStop():
             return
 
-        self._log(Log.DEBUG, "running: %s" % " ".join(self.args))
+        if self.__continuous:
+            if self.__worker is None:
+                self.__worker = threading.Thread(target=self.__run_continuous,
+                                                 name="hackbench-worker")
+                self.__worker.start()
+            return
+
+        if not self._scaled(self.jobs):
+            # Paused at zero intensity
+            return
+
+        args = self.__command()
+        self._log(Log.DEBUG, "running: %s" % " ".join(args))
         try:
-            self.__hbproc = subprocess.Popen(self.args,
-                                             stdin=self.__nullfp,
-                                             stdout=self.__out,
-                                             stderr=self.__err)
-            self.__hbproc.wait()
+            self.__hbproc = self.start_process(args,
+                                              stdin=self.__nullfp,
+                                              stdout=subprocess.PIPE,
+                                              stderr=self.__err)
+            self.__record(self.__hbproc, time.time())
 
         except OSError, e:
             if e.errno != errno.ENOMEM:
@@ -104,7 +125,90 @@ class Hackbench(CommandLineLoad):
                 self.__err_sleep = 60.0
 
 
+    def __command(self):
+        "Returns the hackbench command line, with the number of groups scaled by the load intensity"
+        args = list(self.args)
+        args[args.index('-g') + 1] = str(self._scaled(self.jobs))
+        return args
+
+
+    def __record(self, proc, started):
+        """Waits for a hackbench instance to complete, and records the time of the
+iteration it reported on its output"""
+        output = proc.stdout.read()
+        proc.wait()
+        os.write(self.__out, output)
+        if proc.returncode != 0 or self.shouldStop():
+            # Failed, or stopped before completing the iteration
+            return
+
+        seconds = time.time() - started
+        for line in output.splitlines():
+            if line.startswith("Time:"):
+                try:
+                    seconds = float(line.split()[1])
+                except (IndexError, ValueError):
+                    pass
+        self._addThroughput("iterations", 1, seconds)
+
+
+    def __prefork(self):
+        """Starts the next hackbench instance up to the point where it only needs to
+exec hackbench, which it does when __release() is called"""
+        while not self.shouldStop():
+            try:
+                return self.start_process(['sh', '-c', 'read go && exec "$@"', 'hackbench'] + self.__command(),
+                                          stdin=subprocess.PIPE,
+                                          stdout=subprocess.PIPE,
+                                          stderr=self.__err)
+            except OSError, e:
+                if e.errno != errno.ENOMEM:
+                    raise e
+                self._log(Log.DEBUG, "ERROR: %s, sleeping for %f seconds" % (e.strerror, self.__err_sleep))
+                time.sleep(self.__err_sleep)
+                self.__err_sleep = min(self.__err_sleep * 2.0, 60.0)
+        return None
+
+
+    def __release(self, proc):
+        "Lets a preforked hackbench instance exec hackbench"
+        try:
+            proc.stdin.write("go\n")
+            proc.stdin.close()
+        except IOError:
+            # It was stopped meanwhile
+            pass
+
+
+    def __run_continuous(self):
+        "Keeps hackbench running back to back until the workload is stopped"
+        self._log(Log.DEBUG, "running continuously: %s" % " ".join(self.args))
+        nextproc = self.__prefork()
+        try:
+            while nextproc and not self.shouldStop():
+                if not self._scaled(self.jobs):
+                    # Paused at zero intensity, until the intensity goes up
+                    self.stop_process(nextproc)
+                    while not (self._scaled(self.jobs) or self.shouldStop()):
+                        time.sleep(0.1)
+                    nextproc = self.__prefork()
+                    continue
+
+                self.__hbproc = nextproc
+                self.__release(self.__hbproc)
+                started = time.time()
+                # Prepare the next instance while this one runs
+                nextproc = self.__prefork()
+                self.__record(self.__hbproc, started)
+        except Exception, e:
+            self._log(Log.ERR, "hackbench worker failed: %s" % str(e))
+            self._setRuntimeError()
+        self.stop_process(nextproc)
+
+
     def WorkloadAlive(self):
+        if self.__worker:
+            return self.__worker.is_alive()
         # As hackbench is short-lived, lets pretend it is always alive
         return True
 
@@ -113,12 +217,12 @@ class Hackbench(CommandLineLoad):
         if self._donotrun:
             return
 
-        while self.__hbproc.poll() == None:
-            self._log(Log.DEBUG, "Forcing it to stop")
-            self.__hbproc.send_signal(SIGKILL)
-            if self.__hbproc.poll() == None:
-                time.sleep(2)
-        self.__hbproc.wait()
+        # Stops hackbench and all its sender and receiver processes
+        self.stop_process(self.__hbproc)
+        while self.__worker and self.__worker.is_alive():
+            # The worker may just have released the next instance
+            self.__worker.join(0.1)
+            self.stop_process(self.__hbproc)
 
         os.close(self.__nullfp)
         if self._logging:
@@ -135,7 +239,10 @@ class Hackbench(CommandLineLoad):
 def ModuleParameters():
     return {"jobspercore": {"descr": "Number of working threads per CPU core",
                             "default": 5,
-                            "metavar": "NUM"}
+                            "metavar": "NUM"},
+            "continuous":  {"descr": "Keep hackbench running back to back instead of once a minute (1/0)",
+                            "default": None,
+                            "metavar": "BOOL"}
             }
 
 
@@ -25,18 +25,33 @@
 #   are deemed to be part of the source code.
 #
 
-import sys, os, glob, subprocess
-from signal import SIGTERM
-from rteval.modules import rtevalRuntimeError
+import sys, os, time, glob, subprocess, hashlib, shutil, tarfile, tempfile, json
+import schedutils
+from rteval.modules import rtevalRuntimeError, parse_bool
 from rteval.modules.loads import CommandLineLoad
 from rteval.Log import Log
-from rteval.sysinfo.tools import set_usergroup_ids
+from rteval.sysinfo.tools import set_usergroup_ids, get_usergroup_ids, getcmdpath, mkdir, chown
+from rteval.sysinfo.cputopology import parse_cpulist, collapse_cpulist, cpu_nodes
 
-kernel_prefix="linux-2.6"
+kernel_prefix="linux-"
+
+# Magic bytes of the compressed tarball formats, and their parallel
+# decompressors in order of preference.  Without one of them installed,
+# the tarball is extracted with a streaming tarfile reader instead, which
+# has no xz support.
+compressions = (("gz",  "\x1f\x8b",     (["pigz", "-dc"],)),
+                ("bz2", "BZh",          (["lbzip2", "-dc"], ["pbzip2", "-dc"])),
+                ("xz",  "\xfd7zXZ\x00", (["pixz", "-d"], ["xz", "-T0", "-dc"])))
+
+# Extraction manifest in the build directory
+manifest_name = "kcompile-extract.manifest"
 
 class Kcompile(CommandLineLoad):
     def __init__(self, config, logger):
         CommandLineLoad.__init__(self, "kcompile", config, logger)
+        # _WorkloadTask() only restarts make when it has completed,
+        # so do that as soon as it is noticed
+        self._task_interval = 0.0
 
 
     def _WorkloadSetup(self):
@@ -49,49 +64,204 @@ class Kcompile(CommandLineLoad):
             self.mydir = source
         else:
             if self._cfg.has_key('tarball') and self._cfg.tarball is not None:
-                tarfile = os.path.abspath(self._cfg.tarball)
-                if not os.path.exists(tarfile):
-                    raise rtevalRuntimeError(self, " tarfile %s does not exist!" % tarfile)
-                self.source = tarfile
+                tarball = os.path.abspath(self._cfg.tarball)
+                if not os.path.exists(tarball):
+                    raise rtevalRuntimeError(self, " tarfile %s does not exist!" % tarball)
+                self.source = tarball
             else:
-                tarfiles = glob.glob(os.path.join(self.srcdir, "%s*" % kernel_prefix))
+                tarfiles = glob.glob(os.path.join(self.srcdir, "%s*.tar*" % kernel_prefix))
                 if len(tarfiles):
-                    self.source = tarfiles[0]
+                    tarfiles.sort()
+                    self.source = tarfiles[-1]
                 else:
                     raise rtevalRuntimeError(self, " no kernel tarballs found in %s" % self.srcdir)
 
-            # check for existing directory
-            kdir=None
-            names=os.listdir(self.builddir)
-            for d in names:
-                if d.startswith(kernel_prefix):
-                    kdir=d
-                    break
-            if kdir == None:
-                self._log(Log.DEBUG, "unpacking kernel tarball")
-                tarargs = ['tar', '-C', self.builddir, '-x']
-                if self.source.endswith(".bz2"):
-                    tarargs.append("-j")
-                elif self.source.endswith(".gz"):
-                    tarargs.append("-z")
-                tarargs.append("-f")
-                tarargs.append(self.source)
-                try:
-                    subprocess.call(tarargs, preexec_fn=set_usergroup_ids)
-                except:
-                    raise rtevalRuntimeError(self, " untar'ing kernel '%s' failed!" % self.source)
-                names = os.listdir(self.builddir)
-                for d in names:
-                    self._log(Log.DEBUG, "checking %s" % d)
-                    if d.startswith(kernel_prefix):
-                        kdir=d
-                        break
-            if kdir == None:
-                raise rtevalRuntimeError(self, "Can't find kernel directory!")
+            # reuse the directory extracted by a previous run, unless the tarball changed
+            kdir = self.__extracted()
+            if kdir is None:
+                kdir = self.__extract()
             self.mydir = os.path.join(self.builddir, kdir)
         self.jobs = 1 # We only run one instance of the kcompile job
         self._log(Log.DEBUG, "mydir = %s" % self.mydir)
 
+        # The kernel is built out of tree, in a build cache directory
+        # which is reused by later runs with the same source and config
+        self.__kconfig = self._cfg.setdefault('config', None) or 'allmodconfig'
+        self.__cachedir = self._cfg.setdefault('cachedir', None) or os.path.join(self.builddir, 'kcompile-cache')
+        self.__cachekey = self.__cache_key()
+        self.__objdir = os.path.join(self.__cachedir, self.__cachekey[:16])
+
+        # One compile instance per NUMA node, each with its own build directory
+        self.__nodes = []
+        if parse_bool(self._cfg.setdefault('pernode', False)):
+            self.__nodes = self.__node_cpus()
+            if len(self.__nodes) < 2:
+                self._log(Log.DEBUG, "less than two NUMA nodes, running a single instance")
+                self.__nodes = []
+        if self.__nodes:
+            self.__objdirs = ["%s-node%d" % (self.__objdir, node) for (node, cpus) in self.__nodes]
+        else:
+            self.__objdirs = [self.__objdir]
+        self._log(Log.DEBUG, "objdir = %s" % ", ".join(self.__objdirs))
+
+
+    def __node_cpus(self):
+        "Returns a list of (node, cpus) tuples of the NUMA nodes the load may run on"
+        nodes = {}
+        allowed = self.cpulist and parse_cpulist(self.cpulist) or None
+        for (cpu, node) in cpu_nodes().items():
+            if allowed is None or cpu in allowed:
+                nodes.setdefault(node, []).append(cpu)
+        return [(node, sorted(nodes[node])) for node in sorted(nodes.keys())]
+
+
+    def __tarball_id(self):
+        "Identifies the tarball in the extraction manifest"
+        st = os.stat(self.source)
+        return {"tarball": self.source, "size": st.st_size, "mtime": st.st_mtime}
+
+
+    def __extracted(self):
+        """Returns the kernel directory extracted from the tarball by a previous run,
+according to the extraction manifest, or None if it needs to be extracted"""
+        try:
+            fp = open(os.path.join(self.builddir, manifest_name), 'r')
+            manifest = json.load(fp)
+            fp.close()
+        except (IOError, ValueError):
+            return None
+
+        kdir = manifest.pop("kdir", None)
+        if not kdir or not os.path.isdir(os.path.join(self.builddir, kdir)):
+            return None
+        if manifest != self.__tarball_id():
+            self._log(Log.DEBUG, "removing stale kernel source %s" % kdir)
+            shutil.rmtree(os.path.join(self.builddir, kdir))
+            return None
+        return kdir
+
+
+    def __compression(self):
+        "Returns the compression format and decompressor command of the tarball"
+        fp = open(self.source, 'rb')
+        magic = fp.read(6)
+        fp.close()
+
+        for (fmt, fmtmagic, decompressors) in compressions:
+            if magic.startswith(fmtmagic):
+                for cmd in decompressors:
+                    try:
+                        getcmdpath(cmd[0])
+                        return (fmt, cmd)
+                    except (RuntimeError, KeyError):
+                        continue
+                return (fmt, None)
+        return (None, None)
+
+
+    def __untar(self, destdir, fmt):
+        "Extracts the tarball with a streaming tarfile reader"
+        if fmt == "xz":
+            raise rtevalRuntimeError(self, " no xz decompressor found for %s" % self.source)
+
+        (uid, gid) = get_usergroup_ids()
+        tar = tarfile.open(self.source, fmt and "r|%s" % fmt or "r|")
+        for ti in tar:
+            if ti.name.startswith("/") or ".." in ti.name.split("/"):
+                self._log(Log.WARN, "skipping %s in %s" % (ti.name, self.source))
+                continue
+            # the extracted files belong to the real caller
+            (ti.uid, ti.gid, ti.uname, ti.gname) = (uid, gid, "", "")
+            tar.extract(ti, destdir)
+        tar.close()
+
+
+    def __extract(self):
+        """Extracts the kernel tarball to the build directory, using a parallel
+decompressor when installed, and records it in the extraction manifest"""
+        (fmt, cmd) = self.__compression()
+        destdir = tempfile.mkdtemp(prefix=".kcompile-", dir=self.builddir)
+        chown(destdir)
+
+        try:
+            if cmd:
+                self._log(Log.DEBUG, "unpacking kernel tarball with %s" % cmd[0])
+                infp = open(self.source, 'rb')
+                decomp = subprocess.Popen(cmd, stdin=infp, stdout=subprocess.PIPE,
+                                          preexec_fn=set_usergroup_ids)
+                ret = subprocess.call(['tar', '-C', destdir, '-x', '-f', '-'],
+                                      stdin=decomp.stdout, preexec_fn=set_usergroup_ids)
+                decomp.stdout.close()
+                infp.close()
+                if decomp.wait() or ret:
+                    raise rtevalRuntimeError(self, " untar'ing kernel '%s' failed!" % self.source)
+            else:
+                self._log(Log.DEBUG, "unpacking kernel tarball")
+                self.__untar(destdir, fmt)
+
+            names = os.listdir(destdir)
+            if len(names) != 1 or not os.path.isdir(os.path.join(destdir, names[0])):
+                raise rtevalRuntimeError(self, "Can't find kernel directory!")
+            kdir = names[0]
+
+            # replace a previous extraction of the same directory
+            if os.path.exists(os.path.join(self.builddir, kdir)):
+                shutil.rmtree(os.path.join(self.builddir, kdir))
+            os.rename(os.path.join(destdir, kdir), os.path.join(self.builddir, kdir))
+        finally:
+            shutil.rmtree(destdir, True)
+
+        manifest = self.__tarball_id()
+        manifest["kdir"] = kdir
+        fname = os.path.join(self.builddir, manifest_name)
+        fp = open(fname, 'w')
+        json.dump(manifest, fp)
+        fp.close()
+        chown(fname)
+        return kdir
+
+
+    def __cache_key(self):
+        "Returns the build cache key, a checksum of the kernel source and config"
+        key = hashlib.sha1()
+        if os.path.isfile(self.source):
+            fp = open(self.source, 'rb')
+            while True:
+                data = fp.read(1024*1024)
+                if not data:
+                    break
+                key.update(data)
+            fp.close()
+        else:
+            # An already extracted source tree, which may change
+            key.update(os.path.abspath(self.source))
+            key.update(str(os.stat(os.path.join(self.mydir, "Makefile")).st_mtime))
+        key.update(os.path.basename(self.mydir))
+        key.update(self.__kconfig)
+        return key.hexdigest()
+
+
+    def __cache_valid(self, objdir):
+        "Returns True if the build cache directory is configured for the current key"
+        try:
+            fp = open(os.path.join(objdir, ".rteval-cache"), 'r')
+            key = fp.readline().strip()
+            fp.close()
+        except IOError:
+            return False
+        return key == self.__cachekey and os.path.exists(os.path.join(objdir, ".config"))
+
+
+    def __new_cache(self, objdir):
+        "Creates an empty build cache directory, removing those of other keys"
+        if not os.path.isdir(self.__cachedir):
+            mkdir(self.__cachedir)
+        for d in os.listdir(self.__cachedir):
+            if not d.startswith(self.__cachekey[:16]) or os.path.join(self.__cachedir, d) == objdir:
+                self._log(Log.DEBUG, "removing build cache %s" % d)
+                shutil.rmtree(os.path.join(self.__cachedir, d))
+        mkdir(objdir)
+
 
     def _WorkloadBuild(self):
         self._log(Log.DEBUG, "setting up all module config file in %s" % self.mydir)
@@ -102,16 +272,37 @@ class Kcompile(CommandLineLoad):
         else:
             out = err = null
 
-        # clean up from potential previous run
+        cmds = []
+        uncached = []
+        for objdir in self.__objdirs:
+            if self.__cache_valid(objdir):
+                # clean up the objects of a previous run, keeping the config
+                self._log(Log.DEBUG, "reusing build cache %s" % objdir)
+                cmds.append(["make", "-C", self.mydir, "O=%s" % objdir, "clean"])
+            else:
+                self.__new_cache(objdir)
+                cmds.append(["make", "-C", self.mydir, "O=%s" % objdir, self.__kconfig])
+                uncached.append(objdir)
+        if uncached:
+            # an out of tree build needs a clean source tree
+            cmds.insert(0, ["make", "-C", self.mydir, "mrproper"])
+
         try:
-            ret = subprocess.call(["make", "-C", self.mydir, "mrproper", "allmodconfig"], 
-                                  stdin=null, stdout=out, stderr=err,
-                                  preexec_fn=set_usergroup_ids)
-            if ret:
-                raise rtevalRuntimeError(self, "kcompile setup failed: %d" % ret)
+            for cmd in cmds:
+                ret = subprocess.call(cmd, stdin=null, stdout=out, stderr=err,
+                                      preexec_fn=set_usergroup_ids)
+                if ret:
+                    raise rtevalRuntimeError(self, "kcompile setup failed: %d" % ret)
         except KeyboardInterrupt, m:
             self._log(Log.DEBUG, "keyboard interrupt, aborting")
             return
+
+        for objdir in uncached:
+            stamp = os.path.join(objdir, ".rteval-cache")
+            fp = open(stamp, 'w')
+            fp.write("%s\n" % self.__cachekey)
+            fp.close()
+            chown(stamp)
         self._log(Log.DEBUG, "ready to run")
         os.close(null)
         if self._logging:
@@ -120,7 +311,7 @@ class Kcompile(CommandLineLoad):
         self._setReady()
 
 
-    def __calc_numjobs(self):
+    def __calc_numjobs(self, ncpus):
         mult = int(self._cfg.setdefault('jobspercore', 1))
         mem = self.memsize[0]
         if self.memsize[1] == 'KB':
@@ -131,10 +322,10 @@ class Kcompile(CommandLineLoad):
             mem = mem * 1024
         ratio = float(mem) / float(self.num_cpus)
         if ratio > 1.0:
-            njobs = self.num_cpus * mult
+            njobs = ncpus * mult
         else:
             self._log(Log.DEBUG, "Low memory system (%f GB/core)! Dropping jobs to one per core" % ratio)
-            njobs = self.num_cpus
+            njobs = ncpus
         return njobs
 
 
@@ -146,23 +337,145 @@ class Kcompile(CommandLineLoad):
         else:
             self.__outfd = self.__errfd = self.__nullfd
 
-        self.jobs = self.__calc_numjobs()
+        # (command, CPUs to bind to) and number of jobs of each compile instance
+        self.__instances = []
+        self.__njobs = []
+        if not self.__nodes:
+            self.jobs = self.__calc_numjobs(self.num_cpus)
+            self.__instances.append((["make", "-C", self.mydir, "O=%s" % self.__objdir,
+                                      "-j%d" % self.jobs], None))
+            self.__njobs.append(self.jobs)
+        else:
+            self.jobs = 0
+            numactl = self.__numactl()
+            for ((node, cpus), objdir) in zip(self.__nodes, self.__objdirs):
+                njobs = self.__calc_numjobs(len(cpus))
+                self.jobs += njobs
+                cmd = ["make", "-C", self.mydir, "O=%s" % objdir, "-j%d" % njobs]
+                if numactl:
+                    # bind both the CPUs and the memory to the node
+                    cmd = [numactl, "--physcpubind=%s" % collapse_cpulist(cpus),
+                           "--membind=%d" % node] + cmd
+                    cpus = None
+                self.__instances.append((cmd, cpus))
+                self.__njobs.append(njobs)
+
         self._log(Log.DEBUG, "starting loop (jobs: %d)" % self.jobs)
-        self.args = ["make", "-C", self.mydir,
-                     "-j%d" % self.jobs ]
-        self.__kcompileproc = None
+        self.args = []
+        for (cmd, cpus) in self.__instances:
+            self.args += (self.args and [";"] or []) + cmd
+        self.__kcompileprocs = [None] * len(self.__instances)
+        # The start time of the build in progress, None until a new one is
+        # started, whether the tree has to be cleaned before it and the
+        # make clean process doing so
+        self.__kcompilestart = [None] * len(self.__instances)
+        self.__rebuild = [False] * len(self.__instances)
+        self.__cleanprocs = [None] * len(self.__instances)
+        self.__runjobs = [None] * len(self.__instances)
+
+
+    def __numactl(self):
+        "Returns the path of numactl, or None if it is not installed"
+        try:
+            return getcmdpath("numactl")
+        except (RuntimeError, KeyError):
+            self._log(Log.DEBUG, "numactl not found, binding the compile instances to CPUs only")
+            return None
+
+
+    def __preexec(self, cpus):
+        "Returns the preexec_fn of a compile instance, binding it to the given CPUs"
+        def preexec():
+            if cpus:
+                schedutils.set_affinity(0, cpus)
+            set_usergroup_ids()
+        return preexec
+
+
+    def __count_objects(self, cmd):
+        "Returns the number of object files in the build directory of a compile instance"
+        objdir = [a[2:] for a in cmd if a.startswith("O=")][0]
+        count = 0
+        for (path, dirs, files) in os.walk(objdir):
+            count += len([f for f in files if f.endswith(".o")])
+        return count
+
+
+    def __build_finished(self, i, cmd, proc):
+        "Returns True if the build process of instance i exited, accounting it if it completed"
+        if proc.poll() is None:
+            return False
+        if proc.returncode == 0:
+            self._addThroughput("builds", 1, time.time() - self.__kcompilestart[i])
+            self._addThroughput("objects", self.__count_objects(cmd))
+        return True
 
 
     def _WorkloadTask(self):
-        if not self.__kcompileproc or self.__kcompileproc.poll() is not None:
+        for (i, (cmd, cpus)) in enumerate(self.__instances):
+            proc = self.__kcompileprocs[i]
+            njobs = self._scaled(self.__njobs[i])
+            clean = self.__cleanprocs[i]
+            if clean and clean.poll() is None:
+                if not njobs:
+                    # Paused at zero intensity, cleaned again when resumed
+                    self._log(Log.DEBUG, "Pausing kcompile clean")
+                    self.stop_process(clean)
+                    self.__cleanprocs[i] = None
+                continue
+            elif clean:
+                if clean.returncode:
+                    self._log(Log.WARN, "kcompile clean failed: %d" % clean.returncode)
+                self.__cleanprocs[i] = None
+                self.__rebuild[i] = False
+
+            if proc and self.__build_finished(i, cmd, proc):
+                # Build everything again, not just what changed since
+                self.__kcompilestart[i] = None
+                self.__rebuild[i] = True
+            elif proc and not njobs:
+                # Paused at zero intensity, make continues the build when resumed
+                self._log(Log.DEBUG, "Pausing kcompile")
+                self.stop_process(proc)
+            elif proc:
+                if abs(njobs - self.__runjobs[i]) * 4 < self.__runjobs[i]:
+                    continue
+                # Follow a change of the load intensity by a quarter or more,
+                # make continues the build where it was stopped
+                self._log(Log.DEBUG, "Restarting kcompile with %d jobs" % njobs)
+                self.stop_process(proc)
+
+            if not njobs:
+                self.__kcompileprocs[i] = None
+                continue
+
+            if self.__rebuild[i]:
+                # kbuild does not support mixing clean with other goals in
+                # a parallel make, so clean in a separate make first.  It is
+                # polled like the build, which is started once it is done.
+                clean = [a for a in cmd if not a.startswith("-j")] + ["clean"]
+                self._log(Log.DEBUG, "Cleaning kcompile: %s" % " ".join(clean))
+                self.__cleanprocs[i] = self.start_process(clean,
+                                                          stdin=self.__nullfd,
+                                                          stdout=self.__outfd,
+                                                          stderr=self.__errfd,
+                                                          preexec_fn=self.__preexec(cpus))
+                self.__kcompileprocs[i] = None
+                continue
+
             # If kcompile has not been kicked off yet, or have completed,
             # restart it
-            self._log(Log.DEBUG, "Kicking off kcompile: %s" % " ".join(self.args))
-            self.__kcompileproc = subprocess.Popen(self.args,
-                                                   stdin=self.__nullfd,
-                                                   stdout=self.__outfd,
-                                                   stderr=self.__errfd,
-                                                   preexec_fn=set_usergroup_ids)
+            cmd = [a.startswith("-j") and "-j%d" % njobs or a for a in cmd]
+            self._log(Log.DEBUG, "Kicking off kcompile: %s" % " ".join(cmd))
+            self.__kcompileprocs[i] = self.start_process(cmd,
+                                                         stdin=self.__nullfd,
+                                                         stdout=self.__outfd,
+                                                         stderr=self.__errfd,
+                                                         preexec_fn=self.__preexec(cpus))
+            if self.__kcompilestart[i] is None:
+                # A new build, not a paused or restarted one continued
+                self.__kcompilestart[i] = time.time()
+            self.__runjobs[i] = njobs
 
 
     def WorkloadAlive(self):
@@ -173,10 +486,20 @@ class Kcompile(CommandLineLoad):
 
     def _WorkloadCleanup(self):
         self._log(Log.DEBUG, "out of stopevent loop")
-        if self.__kcompileproc.poll() == None:
-            self._log(Log.DEBUG, "killing compile job with SIGTERM")
-            os.kill(self.__kcompileproc.pid, SIGTERM)
-        self.__kcompileproc.wait()
+        # A build which completed since the last task counts as completed
+        for (i, (cmd, cpus)) in enumerate(self.__instances):
+            proc = self.__kcompileprocs[i]
+            if proc and self.__build_finished(i, cmd, proc):
+                self.__kcompileprocs[i] = None
+
+        # Stops make and all the compile jobs it started
+        for proc in self.__kcompileprocs + self.__cleanprocs:
+            self.stop_process(proc)
+
+        # Count the objects of the builds which did not complete
+        for ((cmd, cpus), proc) in zip(self.__instances, self.__kcompileprocs):
+            if proc:
+                self._addThroughput("objects", self.__count_objects(cmd))
         os.close(self.__nullfd)
         del self.__nullfd
         if self._logging:
@@ -184,10 +507,18 @@ class Kcompile(CommandLineLoad):
             del self.__outfd
             os.close(self.__errfd)
             del self.__errfd
-        del self.__kcompileproc
+        del self.__kcompileprocs
+        del self.__cleanprocs
         self._setFinished()
 
 
+    def MakeReport(self):
+        rep_n = CommandLineLoad.MakeReport(self)
+        if rep_n and self.__nodes:
+            rep_n.newProp("numa_nodes", ",".join([str(node) for (node, cpus) in self.__nodes]))
+        return rep_n
+
+
 
 def ModuleParameters():
     return {"tarball":      {"descr": "Source tar ball",
@@ -196,10 +527,91 @@ def ModuleParameters():
                              "metavar": "SOURCE"},
             "jobspercore":  {"descr": "Number of working threads per core",
                              "default": 2,
-                             "metavar": "NUM"}
+                             "metavar": "NUM"},
+            "config":       {"descr": "Kernel config target",
+                             "default": "allmodconfig",
+                             "metavar": "TARGET"},
+            "cachedir":     {"descr": "Directory of the cached kernel build, reused by later runs",
+                             "metavar": "DIR"},
+            "pernode":      {"descr": "Run one compile instance per NUMA node, bound to the node (1/0)",
+                             "default": None,
+                             "metavar": "BOOL"}
             }
 
 
 
 def create(config, logger):
     return Kcompile(config, logger)
+
+
+
+def unit_test(rootdir):
+    from rteval.rtevalConfig import rtevalCfgSection
+    global compressions
+
+    def setup(builddir, tarball):
+        "Runs the setup of a kcompile load, returning its kernel directory"
+        kc = Kcompile(rtevalCfgSection({'builddir': builddir, 'tarball': tarball,
+                                        'logging': False}), Log())
+        kc._WorkloadSetup()
+        return kc.mydir
+
+    tmpdir = tempfile.mkdtemp()
+    saved = compressions
+    try:
+        # A small kernel tarball, with a member escaping the build directory
+        srcdir = os.path.join(tmpdir, "src")
+        os.makedirs(os.path.join(srcdir, "linux-0.1", "kernel"))
+        for name in ("Makefile", "kernel/sched.c"):
+            fp = open(os.path.join(srcdir, "linux-0.1", name), 'w')
+            fp.write("# %s\n" % name)
+            fp.close()
+        tarball = os.path.join(tmpdir, "linux-0.1.tar.gz")
+        tar = tarfile.open(tarball, "w:gz")
+        tar.add(os.path.join(srcdir, "linux-0.1"), "linux-0.1")
+        tar.add(os.path.join(srcdir, "linux-0.1", "Makefile"), "../escaped")
+        tar.close()
+        builddir = os.path.join(tmpdir, "build")
+
+        # Without a parallel decompressor, the tarfile reader extracts it
+        compressions = tuple([(fmt, magic, (["rteval-no-such-decompressor"],))
+                              for (fmt, magic, cmds) in saved])
+        kdir = setup(builddir, tarball)
+        if kdir != os.path.join(builddir, "linux-0.1") \
+                or not os.path.isfile(os.path.join(kdir, "kernel", "sched.c")):
+            print "** Kernel tarball not extracted to %s" % kdir
+            return 1
+        if os.path.exists(os.path.join(tmpdir, "escaped")):
+            print "** Extracted a member outside of the build directory"
+            return 1
+        print "Tarfile extraction: OK"
+
+        # The manifest lets the next run reuse the extracted directory
+        fp = open(os.path.join(kdir, "reused"), 'w')
+        fp.close()
+        if setup(builddir, tarball) != kdir or not os.path.exists(os.path.join(kdir, "reused")):
+            print "** Extracted kernel directory not reused"
+            return 1
+        print "Manifest reuse: OK"
+
+        # A changed tarball is extracted again
+        st = os.stat(tarball)
+        os.utime(tarball, (st.st_atime, st.st_mtime + 10))
+        if setup(builddir, tarball) != kdir or os.path.exists(os.path.join(kdir, "reused")):
+            print "** Stale kernel directory reused"
+            return 1
+        fp = open(os.path.join(builddir, manifest_name), 'r')
+        manifest = json.load(fp)
+        fp.close()
+        if manifest != {"tarball": tarball, "size": st.st_size,
+                        "mtime": os.stat(tarball).st_mtime, "kdir": "linux-0.1"}:
+            print "** Unexpected extraction manifest: %s" % str(manifest)
+            return 1
+        print "Stale tarball: OK"
+        return 0
+    except Exception, e:
+        print "** EXCEPTION %s", str(e)
+        return 1
+    finally:
+        compressions = saved
+        shutil.rmtree(tmpdir)
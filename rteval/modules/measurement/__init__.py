@@ -26,6 +26,31 @@ import libxml2
 from rteval.modules import RtEvalModules, ModuleContainer
 
 
+def percentiles_converged(history, tolerance, windows):
+    """Returns True when the live percentile estimates in the last windows + 1
+entries of history have converged.  Each entry is a dictionary of (low, estimate,
+high) latencies per measured item, as returned by LivePercentile().  Between
+consecutive entries, the estimate of every item must stay within the tolerance (a
+fraction of the estimate, but at least 1us), and the width of each confidence
+interval must be within twice the tolerance.  Never converges while an item has
+no reliable estimate, which includes estimates without new samples: stale data
+would look perfectly stable"""
+    history = history[-(windows + 1):]
+    if len(history) <= windows or not history[-1]:
+        return False
+
+    for (prev, curr) in zip(history[:-1], history[1:]):
+        for (key, bounds) in curr.items():
+            if bounds is None or prev.get(key) is None:
+                return False
+            (low, est, high) = bounds
+            # Latencies have a resolution of 1us
+            slack = max(tolerance * est, 1.0)
+            if abs(est - prev[key][1]) > slack or high - low > 2 * slack:
+                return False
+    return True
+
+
 class MeasurementProfile(RtEvalModules):
     """Keeps and controls all the measurement modules with the same measurement profile"""
 
@@ -194,6 +219,14 @@ measurement profiles, based on their characteristics"""
         return rep_n
 
 
+    def GetTimings(self):
+        "Returns a dictionary with the phase timings of all measurement modules in all profiles"
+        ret = {}
+        for mp in self.__measureprofiles:
+            ret.update(mp.GetTimings())
+        return ret
+
+
     def __iter__(self):
         "Initiates an iteration loop for MeasurementProfile objects"
 
@@ -25,20 +25,309 @@
 #   are deemed to be part of the source code.
 #
 
-import os, sys, subprocess, signal, libxml2, shutil, tempfile, time
+import os, sys, subprocess, signal, libxml2, shutil, tempfile, time, threading
+import schedutils
+from array import array
+from itertools import compress, izip
+from decimal import Decimal, ROUND_CEILING
 from rteval.Log import Log
-from rteval.modules import rtevalModulePrototype
+from rteval.modules import rtevalModulePrototype, parse_bool
+from rteval.sysinfo.cputopology import parse_cpulist, collapse_cpulist, online_cpus, cpu_nodes
+
+# cyclictest keeps the verbose samples of each thread in a ring buffer of
+# this many entries, which it overwrites when the reader falls behind
+VERBOSE_BUFFER = 16384
+
+# Verbose samples per second the live mode reader keeps up with
+LIVE_SAMPLE_RATE = 100000
+
+
+class LinearHistogram(object):
+    "Histogram with one bucket per microsecond, growing when needed"
+
+    __slots__ = ('__nbuckets', '__counts')
+
+    def __init__(self, nbuckets):
+        self.__nbuckets = int(nbuckets)
+        self.__counts = array('L', [0]) * self.__nbuckets
+
+    def add(self, value, count=1):
+        if value >= len(self.__counts):
+            self.__counts.extend(array('L', [0]) * (value + 1 - len(self.__counts)))
+        self.__counts[value] += count
+
+    def addmany(self, values, counts):
+        "Adds counts[i] samples of values[i], values must be in ascending order"
+        if values[-1] >= len(self.__counts):
+            self.__counts.extend(array('L', [0]) * (values[-1] + 1 - len(self.__counts)))
+        c = self.__counts
+        for (v, n) in izip(values, counts):
+            c[v] += n
+
+    def used(self):
+        "Returns a list of (latency, count) tuples of the buckets holding samples"
+        counts = self.__counts
+        return [(i, counts[i]) for i in xrange(len(counts)) if counts[i]]
+
+    def merge(self, other):
+        "Adds the samples of another LinearHistogram to this one"
+        for (v, c) in other.used():
+            self.add(v, c)
+
+    def reset(self):
+        self.__counts = array('L', [0]) * self.__nbuckets
+
+    def MakeReport(self):
+        hist_n = libxml2.newNode('histogram')
+        hist_n.newProp('nbuckets', str(len(self.__counts)))
+        for (k, v) in self.used():
+            b_n = hist_n.newChild(None, 'bucket', None)
+            b_n.newProp('index', str(k))
+            b_n.newProp('value', str(v))
+        return hist_n
+
+
+class LogLinearHistogram(object):
+    """Log-linear (HDR style) histogram.  Latencies below 2^precision us are
+counted exactly, above that each power of two range is split into
+2^(precision-1) buckets.  This bounds the relative error to 2^-(precision-1)
+and keeps the number of buckets constant, regardless of the latencies seen.
+Histograms with the same precision are merged by adding their buckets"""
+
+    __slots__ = ('__precision', '__counts')
+
+    # Latencies of 2^MAXBITS us (~71 minutes) and above share the last bucket
+    MAXBITS = 32
+
+    def __init__(self, precision=8):
+        self.__precision = int(precision)
+        if not (1 < self.__precision < self.MAXBITS):
+            raise ValueError("Invalid log-linear histogram precision: %s" % precision)
+        half = 1 << (self.__precision - 1)
+        self.__counts = array('L', [0]) * ((1 << self.__precision)
+                                           + (self.MAXBITS - self.__precision) * half)
+
+    def index(self, value):
+        "Returns the bucket index for a latency"
+        p = self.__precision
+        if value < (1 << p):
+            return value
+        e = value.bit_length() - p
+        if e > self.MAXBITS - p:
+            return len(self.__counts) - 1
+        half = 1 << (p - 1)
+        return (1 << p) + (e - 1) * half + ((value >> e) - half)
+
+    def value(self, index):
+        "Returns the lowest latency counted in a bucket"
+        p = self.__precision
+        if index < (1 << p):
+            return index
+        half = 1 << (p - 1)
+        (e, m) = divmod(index - (1 << p), half)
+        return (m + half) << (e + 1)
+
+    def add(self, value, count=1):
+        self.__counts[self.index(value)] += count
+
+    def addmany(self, values, counts):
+        "Adds counts[i] samples of values[i]"
+        c = self.__counts
+        for (v, n) in izip(values, counts):
+            c[self.index(v)] += n
+
+    def used(self):
+        "Returns a list of (latency, count) tuples of the buckets holding samples"
+        counts = self.__counts
+        return [(self.value(i), counts[i]) for i in xrange(len(counts)) if counts[i]]
+
+    def merge(self, other):
+        "Adds the samples of another LogLinearHistogram with the same precision to this one"
+        if not isinstance(other, LogLinearHistogram) or other.__precision != self.__precision:
+            raise ValueError("Can only merge log-linear histograms with the same precision")
+        counts = self.__counts
+        ocounts = other.__counts
+        for i in xrange(len(counts)):
+            if ocounts[i]:
+                counts[i] += ocounts[i]
+
+    def reset(self):
+        self.__counts = array('L', [0]) * len(self.__counts)
+
+    def MakeReport(self):
+        # Only buckets holding samples are listed, indexed by the lowest
+        # latency they count.  The bucket width follows from the precision.
+        hist_n = libxml2.newNode('histogram')
+        hist_n.newProp('nbuckets', str(len(self.__counts)))
+        hist_n.newProp('format', 'loglinear')
+        hist_n.newProp('precision', str(self.__precision))
+        for (k, v) in self.used():
+            b_n = hist_n.newChild(None, 'bucket', None)
+            b_n.newProp('index', str(k))
+            b_n.newProp('value', str(v))
+        return hist_n
+
+
+def parse_histogram(lines):
+    """Parses the histogram table cyclictest writes when it exits.  All rows are
+read in one go and split into columns.  Returns a tuple (indexes, columns,
+comments) where indexes is the list of bucket indexes, columns a list holding
+the bucket values of each of the following columns and comments the '#' lines"""
+    rows = []
+    comments = []
+    for line in lines:
+        if line.startswith('#'):
+            comments.append(line)
+            continue
+        vals = line.split()
+        if vals:
+            rows.append(vals)
+
+    if not rows:
+        return ([], [], comments)
+
+    # Ignore incomplete rows, which would otherwise truncate all columns
+    width = len(rows[0])
+    cols = zip(*[r for r in rows if len(r) == width])
+    return (map(int, cols[0]), [map(int, c) for c in cols[1:]], comments)
+
+
+def parse_summary_line(line, summary):
+    """Parses one of the per thread summary lines cyclictest writes after the
+histogram, such as '# Max Latencies: 00012 00009' or '# Thread 0: 01234 # 00002
+others', into the summary dictionary"""
+    (key, sep, vals) = line[1:].partition(':')
+    key = key.strip()
+    if not sep:
+        return
+
+    if key in ('Min Latencies', 'Avg Latencies', 'Max Latencies', 'Histogram Overflows'):
+        summary[key] = [int(v) for v in vals.split()]
+    elif key.startswith('Thread '):
+        (cycles, sep, others) = vals.partition('#')
+        summary.setdefault('cycles', {})[int(key.split()[1])] = (
+            [int(c) for c in cycles.split()],
+            others and int(others.split()[0]) or 0)
+
+
+def new_histogram(histtype, nbuckets):
+    "Returns an empty histogram object of the given type ('linear' or 'loglinear')"
+    if histtype == 'linear':
+        return LinearHistogram(nbuckets)
+    elif histtype == 'loglinear':
+        return LogLinearHistogram()
+    raise ValueError("Unknown histogram type: %s" % histtype)
+
+
+def xml_elements(node):
+    "Yields the element children of a libxml2 node"
+    child = node.children
+    while child:
+        if child.type == 'element':
+            yield child
+        child = child.next
+
+
+def histogram_from_report(hist_n):
+    """Returns a histogram object holding the buckets of a <histogram> report node,
+as written by the MakeReport() method of LinearHistogram or LogLinearHistogram"""
+    if hist_n.prop('format') == 'loglinear':
+        hist = LogLinearHistogram(int(hist_n.prop('precision')))
+    else:
+        hist = LinearHistogram(int(hist_n.prop('nbuckets')))
+    for b_n in xml_elements(hist_n):
+        if b_n.name == 'bucket':
+            # The index of a log-linear bucket is the lowest latency it counts
+            hist.add(int(b_n.prop('index')), int(b_n.prop('value')))
+    return hist
+
+
+class LatencySlices(object):
+    """Bounded time series of latency summaries (samples, maximum and 99th
+percentile) for consecutive time slices.  When more than maxslices slices are
+recorded, neighbouring slices are merged and the slice length is doubled, which
+keeps the memory usage bounded for long runs.  The 99th percentile of a merged
+slice is the highest of the two, an upper bound"""
+
+    __slots__ = ('__length', '__maxslices', '__slices', '__current', '__origin', '__start')
+
+    def __init__(self, length, starttime, maxslices=512):
+        self.__length = float(length)
+        self.__maxslices = maxslices
+        # list of (start, length, samples, maximum, p99) tuples
+        self.__slices = []
+        self.__current = RunData('slice', 'slice', 0, lambda t, m: None,
+                                 quantiles=['99'], histtype='loglinear')
+        self.__origin = starttime
+        self.__start = starttime
+
+    def sample(self, value):
+        self.__current.sample(value)
+
+    def roll(self, now, force=False):
+        "Closes the current slice when its time is up, or when forced.  Returns True if closed"
+        if not force and (now - self.__start) < self.__length:
+            return False
+
+        summary = self.__current.Summary()
+        if summary['samples'] > 0:
+            self.__slices.append((self.__start, now - self.__start, summary['samples'],
+                                  summary['max'], summary['percentiles'][0][1]))
+        else:
+            self.__slices.append((self.__start, now - self.__start, 0, 0, 0))
+        self.__current.reset()
+        self.__start = now
+
+        if len(self.__slices) > self.__maxslices:
+            self.__downsample()
+        return True
+
+    def __downsample(self):
+        merged = []
+        for i in xrange(0, len(self.__slices) - 1, 2):
+            (a, b) = (self.__slices[i], self.__slices[i+1])
+            merged.append((a[0], a[1] + b[1], a[2] + b[2], max(a[3], b[3]), max(a[4], b[4])))
+        if len(self.__slices) % 2:
+            merged.append(self.__slices[-1])
+        self.__slices = merged
+        self.__length *= 2
+
+    def GetSlices(self):
+        "Returns the list of (start, length, samples, maximum, p99) tuples recorded so far"
+        return list(self.__slices)
+
+    def MakeReport(self):
+        ts_n = libxml2.newNode('timeseries')
+        ts_n.newProp('slice_length', '%.1f' % self.__length)
+        ts_n.newProp('unit', 'us')
+        for (start, length, n, mx, p99) in self.__slices:
+            s_n = ts_n.newChild(None, 'slice', None)
+            s_n.newProp('start', '%.1f' % (start - self.__origin))
+            s_n.newProp('length', '%.1f' % length)
+            s_n.newProp('samples', str(n))
+            s_n.newProp('maximum', str(mx))
+            s_n.newProp('p99', str(p99))
+        return ts_n
 
 
 class RunData(object):
     '''class to keep instance data from a cyclictest run'''
-    def __init__(self, coreid, datatype, priority, logfnc):
+
+    __slots__ = ('__id', '__type', '__priority', '__description', 'description',
+                 '__samples', '__numsamples', '__min', '__max', '__stddev',
+                 '__mean', '__mode', '__median', '__range', '__mad', '__quantiles',
+                 '__percentiles', '__overflows', '__overflow_cycles', '__overflow_others',
+                 '__threadstats', '__slices', '_log')
+
+    def __init__(self, coreid, datatype, priority, logfnc, nbuckets=2000, quantiles=(),
+                 histtype='linear'):
         self.__id = coreid
         self.__type = datatype
         self.__priority = int(priority)
         self.__description = ''
+        self.description = ''
         # histogram of data
-        self.__samples = {}
+        self.__samples = new_histogram(histtype, nbuckets)
         self.__numsamples = 0
         self.__min = 100000000
         self.__max = 0
@@ -48,23 +337,187 @@ class RunData(object):
         self.__median = 0.0
         self.__range = 0.0
         self.__mad = 0.0
+        # list of quantiles (as strings, in percent) to calculate, and the results
+        self.__quantiles = list(quantiles)
+        self.__percentiles = []
+        # latencies not fitting into the histogram, as reported by cyclictest
+        self.__overflows = None
+        self.__overflow_cycles = []
+        self.__overflow_others = 0
+        # (min, avg, max) as reported by cyclictest itself
+        self.__threadstats = None
+        # time series of latency summaries, see setslices()
+        self.__slices = None
         self._log = logfnc
 
     def sample(self, value):
-        self.__samples[value] += self.__samples.setdefault(value, 0) + 1
+        self.__samples.add(value)
+        if self.__slices is not None:
+            self.__slices.sample(value)
         if value > self.__max: self.__max = value
         if value < self.__min: self.__min = value
         self.__numsamples += 1
 
     def bucket(self, index, value):
-        self.__samples[index] = self.__samples.setdefault(index, 0) + value
+        self.__samples.add(index, value)
         if value and index > self.__max: self.__max = index
         if value and index < self.__min: self.__min = index
         self.__numsamples += value
 
+    def buckets(self, indexes, values):
+        "Adds a complete histogram column, same as calling bucket() for each index/value pair"
+        indexes = list(compress(indexes, values))
+        if not indexes:
+            return
+        values = list(compress(values, values))
+        self.__samples.addmany(indexes, values)
+        if indexes[-1] > self.__max: self.__max = indexes[-1]
+        if indexes[0] < self.__min: self.__min = indexes[0]
+        self.__numsamples += sum(values)
+
+    def overflow(self, count, cycles=None, others=0):
+        """Registers samples which exceeded the histogram width.  cycles is
+a list of the cycle numbers where the overflows happened, others the number
+of overflows cyclictest did not record the cycle number for"""
+        self.__overflows = (self.__overflows or 0) + count
+        if cycles:
+            self.__overflow_cycles.extend(cycles)
+        self.__overflow_others += others
+
+    def threadstats(self, minimum, average, maximum):
+        "Registers the minimum, average and maximum latency reported by cyclictest"
+        self.__threadstats = (minimum, average, maximum)
+        if maximum > self.__max:
+            # Only true if the maximum did not fit into the histogram
+            self.__max = maximum
+
+    def setslices(self, length, starttime):
+        "Starts recording latency summaries of the samples in slices of length seconds"
+        self.__slices = LatencySlices(length, starttime)
+
+    def rollslice(self, now, force=False):
+        "Closes the current time slice if it has lasted long enough, or if forced"
+        if self.__slices is not None:
+            self.__slices.roll(now, force)
+
+    def merge(self, other):
+        "Adds the samples and overflows of another RunData object, with the same histogram type"
+        self.__samples.merge(other.__samples)
+        self.__numsamples += other.__numsamples
+        if other.__numsamples:
+            self.__min = min(self.__min, other.__min)
+        self.__max = max(self.__max, other.__max)
+        if other.__overflows is not None:
+            self.overflow(other.__overflows)
+
+    def mergereport(self, rep_n):
+        """Adds the samples of a node written by MakeReport(), such as a <core> or
+<system> node from the report of a run on another host or day.  The histogram
+must have the same format as the one of this object, which for log-linear
+histograms merges without any loss"""
+        other = RunData(rep_n.prop('id') or rep_n.name, rep_n.name, self.__priority, self._log)
+        for n in xml_elements(rep_n):
+            if n.name == 'histogram':
+                other.__samples = histogram_from_report(n)
+            elif n.name == 'statistics':
+                for stat_n in xml_elements(n):
+                    if stat_n.name == 'samples':
+                        other.__numsamples = int(stat_n.getContent())
+                    elif stat_n.name == 'minimum':
+                        other.__min = int(stat_n.getContent())
+                    elif stat_n.name == 'maximum':
+                        other.__max = int(stat_n.getContent())
+                    elif stat_n.name == 'histogram_overflows':
+                        other.__overflows = int(stat_n.getContent())
+
+        if other.__numsamples == 0:
+            # No histogram is reported without samples
+            if other.__overflows is not None:
+                self.overflow(other.__overflows)
+            return
+        if type(other.__samples) is not type(self.__samples):
+            raise ValueError("Can only merge the report of a histogram of the same format")
+        self.merge(other)
+
+    def reset(self):
+        "Discards all samples collected so far"
+        self.__samples.reset()
+        self.__numsamples = 0
+        self.__min = 100000000
+        self.__max = 0
+        self.__overflows = None
+        self.__overflow_cycles = []
+        self.__overflow_others = 0
+        self.__threadstats = None
+
+    def Samples(self):
+        "Returns the number of samples collected"
+        return self.__numsamples
+
+    def Summary(self):
+        "Returns a dictionary with the statistics available while collecting samples"
+        ret = {'samples': self.__numsamples}
+        if self.__numsamples > 0:
+            ret['min'] = self.__min
+            ret['max'] = self.__max
+            ret['percentiles'] = self.Percentiles(self.__quantiles)
+        return ret
+
+    def Percentiles(self, quantiles):
+        """Returns a list of (quantile, latency) tuples for the given quantiles,
+which are strings or numbers in percent.  The latency is the lowest bucket
+index holding the sample with the rank of the quantile (nearest rank method).
+All quantiles are resolved in a single walk through the histogram.  Histogram
+overflows count as samples above the histogram; a quantile ending up among
+them is reported as the maximum latency, which is an upper bound"""
+        if self.__numsamples == 0:
+            return []
+
+        # Exact rank of each quantile, avoiding floating point rounding
+        population = self.__numsamples + (self.__overflows or 0)
+        ranks = []
+        for (idx, q) in enumerate(quantiles):
+            r = Decimal(str(q)) * population / 100
+            ranks.append((max(int(r.to_integral_value(rounding=ROUND_CEILING)), 1), idx))
+        ranks.sort()
+
+        found = {}
+        total = 0
+        pos = 0
+        for (i, cnt) in self.__samples.used():
+            total += cnt
+            while pos < len(ranks) and ranks[pos][0] <= total:
+                found[ranks[pos][1]] = i
+                pos += 1
+            if pos == len(ranks):
+                break
+        for (rank, idx) in ranks[pos:]:
+            if rank <= population:
+                found[idx] = self.__max
+        return [(str(q), found[idx]) for (idx, q) in enumerate(quantiles) if idx in found]
+
+    def PercentileBounds(self, quantile, z=1.96):
+        """Returns a (low, estimate, high) tuple of latencies for the given percentile.
+low and high are the latencies at the ranks bounding an approximate confidence
+interval of the percentile, from the binomial distribution of the number of
+samples below it (z = 1.96 gives 95%).  Returns None if there are no samples"""
+        import math
+
+        if self.__numsamples == 0:
+            return None
+
+        n = self.__numsamples + (self.__overflows or 0)
+        p = float(quantile) / 100
+        spread = z * math.sqrt(n * p * (1 - p))
+        lowq = max(100.0 * (n * p - spread) / n, 100.0 / n)
+        highq = min(100.0 * (n * p + spread + 1) / n, 100.0)
+        return tuple([l for (q, l) in self.Percentiles([lowq, quantile, highq])])
+
     def reduce(self):
         import math
 
+        self.__percentiles = self.Percentiles(self.__quantiles)
+
         # check to see if we have any samples and if we
         # only have 1 (or none) set the calculated values
         # to zero and return
@@ -75,44 +528,39 @@ class RunData(object):
             return
 
         self._log(Log.INFO, "reducing %s" % self.__id)
-        total = 0
-        keys = self.__samples.keys()
-        keys.sort()
-        sorted = []
+
+        # Only the buckets holding samples contribute to any of the
+        # statistics, so collect them once and walk that list only
+        used = self.__samples.used()
 
         mid = self.__numsamples / 2
 
-        # mean, mode, and median
+        # mean, mode, median and range in a single pass.  The median
+        # deliberately follows the historical calculation, to keep the
+        # reported values identical to earlier rteval versions.
+        total = 0
         occurances = 0
-        lastkey = -1
-        for i in keys:
-            if mid > total and mid <= (total + self.__samples[i]):
+        for (i, cnt) in used:
+            if mid > total and mid <= (total + cnt):
                 if self.__numsamples & 1 and mid == total+1:
-                    self.__median = (lastkey + i) / 2
+                    self.__median = (i - 1) / 2
                 else:
                     self.__median = i
-            total += (i * self.__samples[i])
-            if self.__samples[i] > occurances:
-                occurances = self.__samples[i]
+            total += i * cnt
+            if cnt > occurances:
+                occurances = cnt
                 self.__mode = i
         self.__mean = float(total) / float(self.__numsamples)
-
-        # range
-        for i in keys:
-            if self.__samples[i]:
-                low = i
-                break
-        high = keys[-1]
-        while high and self.__samples[high] == 0:
-            high -= 1
-        self.__range = high - low
+        self.__range = used[-1][0] - used[0][0]
 
         # Mean Absolute Deviation and standard deviation
+        mean = self.__mean
         madsum = 0
         varsum = 0
-        for i in keys:
-            madsum += float(abs(float(i) - self.__mean) * self.__samples[i])
-            varsum += float(((float(i) - self.__mean) ** 2) * self.__samples[i])
+        for (i, cnt) in used:
+            dev = float(i) - mean
+            madsum += float(abs(dev) * cnt)
+            varsum += float((dev ** 2) * cnt)
         self.__mad = madsum / self.__numsamples
         self.__stddev = math.sqrt(varsum / (self.__numsamples - 1))
 
@@ -121,6 +569,8 @@ class RunData(object):
         rep_n = libxml2.newNode(self.__type)
         if self.__type == 'system':
             rep_n.newProp('description', self.__description)
+        elif self.__type == 'node':
+            rep_n.newProp('id', str(self.__id))
         else:
             rep_n.newProp('id', str(self.__id))
             rep_n.newProp('priority', str(self.__priority))
@@ -154,17 +604,31 @@ class RunData(object):
             n = stat_n.newTextChild(None, 'standard_deviation', str(self.__stddev))
             n.newProp('unit', 'us')
 
-            hist_n = rep_n.newChild(None, 'histogram', None)
-            hist_n.newProp('nbuckets', str(len(self.__samples)))
-            keys = self.__samples.keys()
-            keys.sort()
-            for k in keys:
-                if self.__samples[k] == 0:
-                    # Don't report buckets without any samples
-                    continue
-                b_n = hist_n.newChild(None, 'bucket', None)
-                b_n.newProp('index', str(k))
-                b_n.newProp('value', str(self.__samples[k]))
+            for (q, lat) in self.__percentiles:
+                n = stat_n.newTextChild(None, 'percentile', str(lat))
+                n.newProp('q', q)
+                n.newProp('unit', 'us')
+
+            # Buckets without any samples are not reported
+            rep_n.addChild(self.__samples.MakeReport())
+
+        if self.__threadstats is not None:
+            n = stat_n.newChild(None, 'reported', None)
+            n.newProp('minimum', str(self.__threadstats[0]))
+            n.newProp('average', str(self.__threadstats[1]))
+            n.newProp('maximum', str(self.__threadstats[2]))
+            n.newProp('unit', 'us')
+
+        if self.__slices is not None:
+            rep_n.addChild(self.__slices.MakeReport())
+
+        if self.__overflows is not None:
+            stat_n.newTextChild(None, 'histogram_overflows', str(self.__overflows))
+            if self.__overflow_cycles or self.__overflow_others:
+                n = stat_n.newTextChild(None, 'overflow_cycles',
+                                        ' '.join([str(c) for c in self.__overflow_cycles]))
+                if self.__overflow_others:
+                    n.newProp('others', str(self.__overflow_others))
 
         return rep_n
 
@@ -174,40 +638,229 @@ class Cyclictest(rtevalModulePrototype):
         rtevalModulePrototype.__init__(self, 'measurement', 'cyclictest', logger)
         self.__cfg = config
 
-        # Create a RunData object per CPU core
-        f = open('/proc/cpuinfo')
-        self.__numanodes = int(self.__cfg.setdefault('numanodes', 0))
         self.__priority = int(self.__cfg.setdefault('priority', 95))
         self.__buckets = int(self.__cfg.setdefault('buckets', 2000))
-        self.__numcores = 0
-        self.__cyclicdata = {}
+        self.__quantiles = self.__parse_quantiles(self.__cfg.setdefault('percentiles', None)
+                                                  or '99,99.9,99.99,99.999,99.9999')
+        self.__histtype = self.__cfg.setdefault('histogram', None) or 'linear'
+
+        # Only measure the online CPUs, or the ones in the given cpulist.
+        # cyclictest thread i runs on the i-th CPU of this list.
+        online = online_cpus()
+        self.__cpulist = self.__cfg.setdefault('cpulist', None) \
+            or self.__cfg.setdefault('measure_cpulist', None)
+        if self.__cpulist:
+            cpus = parse_cpulist(self.__cpulist)
+            offline = [c for c in cpus if c not in online]
+            if offline:
+                self._log(Log.WARN, "not measuring offline CPUs: %s" % collapse_cpulist(offline))
+            cpus = [c for c in cpus if c in online]
+            if not cpus:
+                raise ValueError("No online CPUs in the cyclictest cpulist: %s" % self.__cpulist)
+            self.__cpulist = collapse_cpulist(cpus)
+        else:
+            cpus = online
+        self.__cpus = [str(c) for c in cpus]
+        self.__numcores = len(self.__cpus)
+        threads = self.__cfg.setdefault('threads', None)
+        if threads and int(threads) != self.__numcores:
+            # Histogram column i must hold the latencies of the i-th measured CPU
+            self._log(Log.WARN, "ignoring threads=%s, running one thread per measured CPU (%d)"
+                      % (threads, self.__numcores))
+
+        # Create a RunData object per measured CPU core
+        descriptions = {}
+        f = open('/proc/cpuinfo')
         for line in f:
             if line.startswith('processor'):
                 core = line.split()[-1]
-                self.__cyclicdata[core] = RunData(core, 'core',self.__priority,
-                                                  logfnc=self._log)
-                self.__numcores += 1
             if line.startswith('model name'):
                 desc = line.split(': ')[-1][:-1]
-                self.__cyclicdata[core].description = ' '.join(desc.split())
+                descriptions[core] = ' '.join(desc.split())
         f.close()
 
+        self.__cyclicdata = {}
+        for core in self.__cpus:
+            self.__cyclicdata[core] = RunData(core, 'core',self.__priority,
+                                              logfnc=self._log,
+                                              nbuckets=self.__buckets,
+                                              quantiles=self.__quantiles,
+                                              histtype=self.__histtype)
+            self.__cyclicdata[core].description = descriptions.get(core, '')
+
         # Create a RunData object for the overall system
         self.__cyclicdata['system'] = RunData('system', 'system', self.__priority,
-                                              logfnc=self._log)
-        self.__cyclicdata['system'].description = ("(%d cores) " % self.__numcores) + self.__cyclicdata['0'].description
-        self._log(Log.DEBUG, "system has %d cpu cores" % self.__numcores)
+                                              logfnc=self._log,
+                                              nbuckets=self.__buckets,
+                                              quantiles=self.__quantiles,
+                                              histtype=self.__histtype)
+        self.__cyclicdata['system'].description = ("(%d cores) " % self.__numcores) + self.__cyclicdata[self.__cpus[0]].description
+        self._log(Log.DEBUG, "measuring %d cpu cores: %s" % (self.__numcores, collapse_cpulist(cpus)))
+
+        # Create a RunData object per NUMA node, if the measured CPUs span
+        # more than one.  __cpunode holds the node key of each measured CPU.
+        nodemap = cpu_nodes()
+        self.__nodes = ['node%d' % n for n in sorted(set([nodemap[c] for c in cpus if c in nodemap]))]
+        if len(self.__nodes) > 1:
+            self.__cpunode = [c in nodemap and 'node%d' % nodemap[c] or None for c in cpus]
+            for node in self.__nodes:
+                self.__cyclicdata[node] = RunData(node[4:], 'node', self.__priority,
+                                                  logfnc=self._log,
+                                                  nbuckets=self.__buckets,
+                                                  quantiles=self.__quantiles,
+                                                  histtype=self.__histtype)
+            self._log(Log.DEBUG, "aggregating %d numa nodes" % len(self.__nodes))
+        else:
+            self.__nodes = []
+            self.__cpunode = [None] * self.__numcores
         self.__started = False
+        self.__cyclicprocess = None
         self.__cyclicoutput = None
         self.__breaktraceval = None
+        self.__live = parse_bool(self.__cfg.setdefault('live', False))
+        self.__slice = float(self.__cfg.setdefault('slice', None) or 0)
+        if self.__slice > 0 and not self.__live:
+            # Time slices are recorded from the streamed samples
+            self._log(Log.DEBUG, "enabling live mode for %.1f second time slices" % self.__slice)
+            self.__live = True
+        (self.__slamax, self.__slapct) = self.__parse_sla(self.__cfg.setdefault('sla', None) or '')
+        self.__slascope = self.__cfg.setdefault('slascope', None) or 'system'
+        if self.__slascope not in ('core', 'system'):
+            raise ValueError("Invalid cyclictest SLA scope: %s" % self.__slascope)
+        self.__slabreach = None
+        if (self.__slamax is not None or self.__slapct) and not self.__live:
+            # The SLA is checked against the streamed samples
+            self._log(Log.DEBUG, "enabling live mode for the latency SLA")
+            self.__live = True
+        if self.__cfg.setdefault('converge', None) and not self.__live:
+            # rteval watches the live percentiles to decide when to stop
+            self._log(Log.DEBUG, "enabling live mode for the adaptive run duration")
+            self.__live = True
+        # [stage, load level, RunData, start, end, dropped samples] of each
+        # stage of a staged run.  The end is None while the stage lasts.
+        self.__stages = []
+        if self.__cfg.setdefault('load_ramp', None) and not self.__live:
+            # The stage histograms are built from the streamed samples
+            self._log(Log.DEBUG, "enabling live mode for the load stages")
+            self.__live = True
+        self.__reader = None
+        self.__histlines = []
+        # Accounting of the streamed samples of each thread: the last cycle
+        # number read, the number of samples read and the number lost, the
+        # time of cycle 0 and the lost samples of the current overrun
+        self.__lastcycle = [-1] * self.__numcores
+        self.__streamed = [0] * self.__numcores
+        self.__dropped = [0] * self.__numcores
+        self.__cyclestart = [None] * self.__numcores
+        self.__overrun = [0] * self.__numcores
+        self.__dropwarned = False
+        # The number of samples of each core at the last LivePercentile() call
+        self.__livesamples = {}
+
+
+    def __parse_quantiles(self, qlist):
+        "Parses a comma separated list of percentiles, such as '99,99.99'"
+        ret = []
+        for q in str(qlist).split(','):
+            q = q.strip()
+            if not q:
+                continue
+            if not (0 < float(q) <= 100):
+                raise ValueError("Invalid cyclictest percentile: %s" % q)
+            ret.append(q)
+        return ret
+
+
+    def __parse_sla(self, sla):
+        """Parses the SLA thresholds, such as 'max=150,99.99=80', into the maximum
+latency (or None) and a list of (percentile, latency) tuples"""
+        slamax = None
+        slapct = []
+        for lim in sla.split(','):
+            lim = lim.strip()
+            if not lim:
+                continue
+            (q, sep, us) = lim.partition('=')
+            q = q.strip().lower().lstrip('p')
+            if not sep or not us.strip().isdigit():
+                raise ValueError("Invalid cyclictest SLA threshold: %s" % lim)
+            if q in ('max', '100'):
+                slamax = int(us)
+            else:
+                slapct.append((self.__parse_quantiles(q)[0], int(us)))
+        return (slamax, slapct)
+
+
+    def __sla_breached(self, limit, threshold, measured, scope, coreid):
+        "Records the first SLA breach and requests the run to be aborted"
+        self.__slabreach = {'limit': limit,
+                            'threshold': str(threshold),
+                            'measured_latency': str(measured),
+                            'scope': scope,
+                            'id': coreid}
+        self._setAbort("%s latency of %dus on %s exceeded the SLA of %dus"
+                       % (limit, measured, scope == 'core' and 'core %s' % coreid or 'the system',
+                          threshold))
+
+
+    def __samples_lost(self):
+        """Returns True when streamed samples were dropped, or when the reader lags
+behind so far that it will read stale samples.  Either makes the live
+percentiles unreliable to decide on.  The first time, a warning is logged"""
+        dropped = sum(self.__dropped)
+        if not dropped:
+            # The reader only counts lost samples once it caught up enough
+            # to check, so also look at how far it is behind right now
+            if self.__cyclicprocess is None or self.__cyclicprocess.poll() is not None:
+                return False
+            now = time.time()
+            if max([self.__lag(thr, now) for thr in range(self.__numcores)]) <= VERBOSE_BUFFER:
+                return False
+        if not self.__dropwarned:
+            self._log(Log.WARN, "%s, the live percentiles are not used"
+                      % (dropped and "%d streamed samples were dropped" % dropped
+                         or "the streamed samples lag behind"))
+            self.__dropwarned = True
+        return True
+
+
+    def __check_sla(self, final=False):
+        """Checks the percentiles collected so far against the SLA.  A percentile is
+only checked once there are enough samples for it to differ from the maximum,
+and not at all once streamed samples were dropped or while the reader lags too
+far behind to read them, as told by __samples_lost().  The final check is done on
+the complete histograms, and also checks the maximum latency"""
+        if not final and self.__samples_lost():
+            return
+        for key in (self.__slascope == 'core' and self.__cpus or ['system']):
+            rd = self.__cyclicdata[key]
+            if final and self.__slamax is not None:
+                summary = rd.Summary()
+                if summary['samples'] and summary['max'] > self.__slamax:
+                    self.__sla_breached('max', self.__slamax, summary['max'], self.__slascope, key)
+                    return
+            pct = dict(rd.Percentiles([q for (q, t) in self.__slapct]))
+            for (q, threshold) in self.__slapct:
+                if q not in pct or rd.Samples() * (100 - Decimal(q)) < 100:
+                    continue
+                if pct[q] > threshold:
+                    self.__sla_breached('p%s' % q, threshold, pct[q], self.__slascope, key)
+                    return
 
 
     def __getmode(self):
-        if self.__numanodes > 1:
-            self._log(Log.DEBUG, "running in NUMA mode (%d nodes)" % self.__numanodes)
-            return '--numa'
-        self._log(Log.DEBUG, "running in SMP mode")
-        return '--smp'
+        """Returns the options placing thread i on the i-th measured CPU, so that
+histogram column i holds the latencies of that CPU"""
+        # No --numa, which would reset the affinity and thread count to all
+        # CPUs.  Pinning each thread to its CPU places it on the right node.
+        # -d0 gives all threads the same interval, as --smp and --numa did.
+        return ["-a%s" % collapse_cpulist([int(c) for c in self.__cpus]),
+                "-t%d" % self.__numcores, "-d0"]
+
+
+    def __set_affinity(self):
+        "Runs in the forked cyclictest process, placing it on the measured CPUs"
+        schedutils.set_affinity(0, [int(c) for c in self.__cpus])
 
 
     def __get_debugfs_mount(self):
@@ -233,23 +886,154 @@ class Cyclictest(rtevalModulePrototype):
 
     def _WorkloadPrepare(self):
         self.__interval = self.__cfg.has_key('interval') and '-i%d' % int(self.__cfg.interval) or ""
+        # The interval in microseconds, 1000 being the cyclictest default
+        self.__intervalus = self.__cfg.has_key('interval') and int(self.__cfg.interval) or 1000
 
         self.__cmd = ['cyclictest',
                       self.__interval,
                       '-qmu',
                       '-h %d' % self.__buckets,
                       "-p%d" % int(self.__priority),
-                      self.__getmode(),
                       ]
 
-        if self.__cfg.has_key('threads') and self.__cfg.threads:
-            self.__cmd.append("-t%d" % int(self.__cfg.threads))
+        # Pin one thread to each measured CPU, in list order
+        self.__cmd += self.__getmode()
 
         if self.__cfg.has_key('breaktrace') and self.__cfg.breaktrace:
             self.__cmd.append("-b%d" % int(self.__cfg.breaktrace))
 
-        # Buffer for cyclictest data written to stdout
-        self.__cyclicoutput = tempfile.SpooledTemporaryFile(mode='rw+b')
+        if self.__live:
+            # Have cyclictest report each sample, which is streamed
+            # into the histograms by __read_output()
+            self.__cmd.append("-v")
+            rate = self.__numcores * 1000000 / self.__intervalus
+            if rate > LIVE_SAMPLE_RATE:
+                self._log(Log.WARN, "live mode streams %d samples/s, more than the about %d/s which can "
+                          "be read in time; the live results will likely be discarded.  Raise the "
+                          "interval or measure fewer CPUs" % (rate, LIVE_SAMPLE_RATE))
+        else:
+            # Buffer for cyclictest data written to stdout
+            self.__cyclicoutput = tempfile.SpooledTemporaryFile(mode='rw+b')
+
+
+    def __read_lines(self, fp):
+        "Yields the lines of a pipe, reading it in large blocks rather than line by line"
+        fd = fp.fileno()
+        rest = ''
+        while True:
+            data = os.read(fd, 65536)
+            if not data:
+                break
+            lines = (rest + data).split('\n')
+            rest = lines.pop()
+            for line in lines:
+                yield line
+        if rest:
+            yield rest
+
+
+    def __lag(self, thr, now):
+        "Returns the number of cycles thread thr ran ahead of the samples read"
+        if self.__cyclestart[thr] is None:
+            return 0
+        return int((now - self.__cyclestart[thr]) * 1000000 / self.__intervalus) - self.__lastcycle[thr]
+
+
+    def __stage_at(self, when):
+        """Returns the entry of the stage lasting at time when, or None.  The stages
+are searched from the last one, where the samples usually belong"""
+        for stage in reversed(self.__stages):
+            if when >= stage[3]:
+                if stage[4] is None or when < stage[4]:
+                    return stage
+                return None
+        return None
+
+
+    def __check_lag(self, now):
+        """Counts the streamed samples lost by the threads lagging behind.  cyclictest
+prints the verbose samples of a thread from a ring buffer of VERBOSE_BUFFER
+entries, with contiguous cycle numbers also when the buffer was overwritten.
+The lag of a thread is the number of cycles elapsed since its cycle 0 less the
+cycle number last read; any lag beyond the buffer size was read as stale values"""
+        for thr in range(self.__numcores):
+            excess = self.__lag(thr, now) - VERBOSE_BUFFER
+            if excess > self.__overrun[thr]:
+                self.__dropped[thr] += excess - self.__overrun[thr]
+                # Accounted to the stage of the latest sample overwritten
+                stage = self.__stage_at(now - VERBOSE_BUFFER * self.__intervalus / 1000000.0)
+                if stage is not None:
+                    stage[5] += excess - self.__overrun[thr]
+                self.__overrun[thr] = excess
+            elif excess <= 0:
+                self.__overrun[thr] = 0
+
+
+    def __read_output(self):
+        """Reader thread in live mode, consuming the cyclictest output while it runs.
+Once a second, the samples lost by falling behind cyclictest are counted in
+__dropped by __check_lag()"""
+        nextcheck = 0
+        nextlag = 0
+        nextsla = 0
+        for line in self.__read_lines(self.__cyclicprocess.stdout):
+            # Don't look at the clock for every sample
+            nextcheck -= 1
+            if nextcheck <= 0:
+                now = time.time()
+                if now >= nextlag:
+                    self.__check_lag(now)
+                    nextlag = now + 1.0
+                if self.__slice > 0:
+                    for rd in self.__cyclicdata.values():
+                        rd.rollslice(now)
+                if self.__slapct and not self.__slabreach and now >= nextsla:
+                    # Percentiles are checked once a second
+                    self.__check_sla()
+                    nextsla = now + 1.0
+                nextcheck = 64
+
+            if line.startswith('#') or line.find(':') == -1:
+                # Comments and the final histogram are parsed in _WorkloadCleanup()
+                self.__histlines.append(line)
+                continue
+
+            # Verbose sample lines: "thread:cycle:latency"
+            try:
+                (thr, cycle, latency) = line.split(':')
+                thr = int(thr)
+                cycle = int(cycle)
+                latency = int(latency)
+            except ValueError:
+                continue
+            if thr >= self.__numcores:
+                continue
+            if self.__cyclestart[thr] is None:
+                # The reader can't lag behind much yet at the first sample
+                self.__cyclestart[thr] = time.time() - cycle * self.__intervalus / 1000000.0
+            if self.__stages:
+                # The sample belongs to the stage at the time it was taken,
+                # which is earlier than now when the reader lags behind
+                stage = self.__stage_at(self.__cyclestart[thr] + cycle * self.__intervalus / 1000000.0)
+            else:
+                stage = None
+            self.__lastcycle[thr] = cycle
+            self.__streamed[thr] += 1
+            self.__cyclicdata[self.__cpus[thr]].sample(latency)
+            self.__cyclicdata['system'].sample(latency)
+            if stage is not None:
+                stage[2].sample(latency)
+            if self.__cpunode[thr]:
+                self.__cyclicdata[self.__cpunode[thr]].sample(latency)
+            if self.__slamax is not None and latency > self.__slamax and not self.__slabreach:
+                self.__sla_breached('max', self.__slamax, latency, self.__slascope,
+                                    self.__slascope == 'core' and self.__cpus[thr] or 'system')
+
+        # Close the last time slice when cyclictest stops
+        now = time.time()
+        for rd in self.__cyclicdata.values():
+            rd.rollslice(now, True)
+        self.__cyclicprocess.stdout.close()
 
 
     def _WorkloadTask(self):
@@ -269,11 +1053,30 @@ class Cyclictest(rtevalModulePrototype):
             fp.flush()
             fp.close()
 
-        self.__cyclicoutput.seek(0)
-        self.__cyclicprocess = subprocess.Popen(self.__cmd,
-                                                stdout=self.__cyclicoutput,
-                                                stderr=self.__nullfp,
-                                                stdin=self.__nullfp)
+        # rteval may run on the housekeeping CPUs only, make sure
+        # cyclictest is allowed to run on the measured CPUs
+        preexec = self.__cpulist and self.__set_affinity or None
+
+        if self.__live:
+            if self.__slice > 0:
+                now = time.time()
+                for rd in self.__cyclicdata.values():
+                    rd.setslices(self.__slice, now)
+            self.__cyclicprocess = subprocess.Popen(self.__cmd,
+                                                    stdout=subprocess.PIPE,
+                                                    stderr=self.__nullfp,
+                                                    stdin=self.__nullfp,
+                                                    preexec_fn=preexec)
+            self.__reader = threading.Thread(target=self.__read_output)
+            self.__reader.daemon = True
+            self.__reader.start()
+        else:
+            self.__cyclicoutput.seek(0)
+            self.__cyclicprocess = subprocess.Popen(self.__cmd,
+                                                    stdout=self.__cyclicoutput,
+                                                    stderr=self.__nullfp,
+                                                    stdin=self.__nullfp,
+                                                    preexec_fn=preexec)
         self.__started = True
 
 
@@ -284,38 +1087,171 @@ class Cyclictest(rtevalModulePrototype):
             return False
 
 
+    def GetLiveStatistics(self):
+        """Returns a dictionary of RunData summaries, indexed by core id and 'system'.
+Only available when cyclictest runs in live mode, otherwise None is returned"""
+        if not self.__live or not self.__started:
+            return None
+
+        ret = {}
+        for (n, rd) in self.__cyclicdata.items():
+            ret[n] = rd.Summary()
+        return ret
+
+
+    def LivePercentile(self, quantile):
+        if not self.__live or not self.__started:
+            return None
+
+        ret = {}
+        if self.__samples_lost():
+            # The estimates may be skewed by the dropped samples
+            for cpu in self.__cpus:
+                ret[cpu] = None
+            return ret
+        for cpu in self.__cpus:
+            # An estimate without new samples since the last call is stale,
+            # and would look perfectly stable
+            samples = self.__cyclicdata[cpu].Samples()
+            if samples == self.__livesamples.get(cpu):
+                ret[cpu] = None
+                continue
+            self.__livesamples[cpu] = samples
+            bounds = self.__cyclicdata[cpu].PercentileBounds(quantile)
+            if bounds:
+                ret[cpu] = bounds
+        return ret
+
+
+    def LiveStatus(self):
+        stats = self.GetLiveStatistics()
+        if stats is None or stats['system']['samples'] == 0:
+            return None
+
+        return "latency: %d samples, min: %dus, max: %dus%s%s" % (
+            stats['system']['samples'], stats['system']['min'], stats['system']['max'],
+            ''.join([", p%s: %dus" % p for p in stats['system']['percentiles']]),
+            sum(self.__dropped) and ", %d dropped" % sum(self.__dropped) or '')
+
+
+    def SetStage(self, stage, level):
+        # The stage boundaries are times, like the times the samples were
+        # taken at, which are derived from their cycle numbers
+        now = time.time()
+        if self.__stages and self.__stages[-1][4] is None:
+            self.__stages[-1][4] = now
+        if stage is None:
+            return
+
+        rd = RunData(str(stage), 'stage', self.__priority,
+                     logfnc=self._log,
+                     nbuckets=self.__buckets,
+                     quantiles=self.__quantiles,
+                     histtype=self.__histtype)
+        self.__stages.append([stage, level, rd, now, None, 0])
+
+
+    def __apply_summary(self, summary):
+        "Adds the parsed cyclictest summary lines to the RunData objects"
+        sysrd = self.__cyclicdata['system']
+        for (i, ovfl) in enumerate(summary.get('Histogram Overflows', [])[:self.__numcores]):
+            (cycles, others) = summary.get('cycles', {}).get(i, ([], 0))
+            self.__cyclicdata[self.__cpus[i]].overflow(ovfl, cycles, others)
+            sysrd.overflow(ovfl)
+            if self.__cpunode[i]:
+                self.__cyclicdata[self.__cpunode[i]].overflow(ovfl)
+            if ovfl:
+                self._log(Log.WARN, "%d latencies on core %s exceeded the histogram width of %dus"
+                          % (ovfl, self.__cpus[i], self.__buckets))
+
+        if 'Max Latencies' in summary:
+            # Thread statistics, grouped by the system and node aggregates
+            stats = {}
+            for (i, st) in enumerate(zip(summary.get('Min Latencies', []),
+                                         summary.get('Avg Latencies', []),
+                                         summary['Max Latencies'])[:self.__numcores]):
+                self.__cyclicdata[self.__cpus[i]].threadstats(*st)
+                stats.setdefault('system', []).append(st)
+                if self.__cpunode[i]:
+                    stats.setdefault(self.__cpunode[i], []).append(st)
+            for (n, st) in stats.items():
+                self.__cyclicdata[n].threadstats(min([s[0] for s in st]),
+                                                 sum([s[1] for s in st]) / len(st),
+                                                 max([s[2] for s in st]))
+
+
+    def _WorkloadTerminate(self):
+        if self.__cyclicprocess and self.__cyclicprocess.poll() == None:
+            os.kill(self.__cyclicprocess.pid, signal.SIGKILL)
+
+
     def _WorkloadCleanup(self):
         while self.__cyclicprocess.poll() == None:
             self._log(Log.DEBUG, "Sending SIGINT")
             os.kill(self.__cyclicprocess.pid, signal.SIGINT)
-            time.sleep(2)
+            deadline = time.time() + 2.0
+            while self.__cyclicprocess.poll() == None and time.time() < deadline:
+                time.sleep(0.1)
+
+        if self.__live:
+            # The final histogram from cyclictest is complete, unlike the
+            # verbose samples which may have been dropped by cyclictest.
+            # Replace what was collected during the run with it.
+            self.__reader.join()
+            self.SetStage(None, None)
+            for (stage, level, rd, start, end, dropped) in self.__stages:
+                rd.reduce()
+                if dropped:
+                    self._log(Log.WARN, "%d streamed samples of load stage %s were dropped"
+                              % (dropped, stage))
+            for n in self.__cyclicdata.keys():
+                self.__cyclicdata[n].reset()
+            output = self.__histlines
+        else:
+            self.__cyclicoutput.seek(0)
+            output = self.__cyclicoutput
 
         # now parse the histogram output
-        self.__cyclicoutput.seek(0)
-        for line in self.__cyclicoutput:
-            if line.startswith('#'):
-                # Catch if cyclictest stopped due to a breaktrace
-                if line.startswith('# Break value: '):
-                    self.__breaktraceval = int(line.split(':')[1])
-                continue
-
-            # Skipping blank lines
-            if len(line) == 0:
-                continue
-
-            vals = line.split()
-            if len(vals) == 0:
-                # If we don't have any values, don't try parsing
-                continue
-
-            index = int(vals[0])
-            for i in range(0, len(self.__cyclicdata)-1):
-                if str(i) not in self.__cyclicdata: continue
-                self.__cyclicdata[str(i)].bucket(index, int(vals[i+1]))
-                self.__cyclicdata['system'].bucket(index, int(vals[i+1]))
+        (indexes, columns, comments) = parse_histogram(output)
+
+        summary = {}
+        for line in comments:
+            # Catch if cyclictest stopped due to a breaktrace
+            if line.startswith('# Break value: '):
+                self.__breaktraceval = int(line.split(':')[1])
+            else:
+                parse_summary_line(line, summary)
+
+        # Column i holds the histogram of thread i, which ran on the i-th measured CPU
+        used = columns[:self.__numcores]
+        nodecols = {}
+        for (cpu, node, column) in zip(self.__cpus, self.__cpunode, used):
+            self.__cyclicdata[cpu].buckets(indexes, column)
+            if node:
+                nodecols.setdefault(node, []).append(column)
+        if used:
+            self.__cyclicdata['system'].buckets(indexes, [sum(r) for r in izip(*used)])
+        for (node, cols) in nodecols.items():
+            self.__cyclicdata[node].buckets(indexes, [sum(r) for r in izip(*cols)])
+        self.__apply_summary(summary)
         for n in self.__cyclicdata.keys():
             self.__cyclicdata[n].reduce()
 
+        if self.__live:
+            # Samples cyclictest did not print, such as at the end of the run,
+            # show as a difference with the final histogram counts
+            overflows = summary.get('Histogram Overflows', [])
+            for (i, column) in enumerate(used):
+                final = sum(column) + (i < len(overflows) and overflows[i] or 0)
+                self.__dropped[i] = max(self.__dropped[i], final - self.__streamed[i])
+            if sum(self.__dropped):
+                self._log(Log.WARN, "%d of the streamed samples were dropped"
+                          % sum(self.__dropped))
+
+        if (self.__slamax is not None or self.__slapct) and not self.__slabreach:
+            # Breaches missed by the live checks, such as in dropped samples
+            self.__check_sla(final=True)
+
         # If the breaktrace feature of cyclictest was enabled and triggered,
         # put the trace into the log directory
         debugdir = self.__get_debugfs_mount()
@@ -356,16 +1292,43 @@ class Cyclictest(rtevalModulePrototype):
             btv_n.newProp('measured_latency', str(self.__breaktraceval))
             abrt = True
 
+        if self.__slabreach:
+            if not abrt:
+                abrt_n.newProp('reason', 'sla')
+            sla_n = abrt_n.newChild(None, 'sla_breach', None)
+            for k in ('limit', 'threshold', 'measured_latency', 'scope', 'id'):
+                sla_n.newProp(k, self.__slabreach[k])
+            abrt = True
+
         # Only add the <abort_report/> node if an abortion happened
         if abrt:
             rep_n.addChild(abrt_n)
 
-        rep_n.addChild(self.__cyclicdata["system"].MakeReport())
-        for thr in range(0, self.__numcores):
-            if str(thr) not in self.__cyclicdata:
-                continue
+        if self.__live:
+            # The histograms come from cyclictest and are complete, but the
+            # live decisions were taken on the streamed samples
+            strm_n = rep_n.newChild(None, 'streamed_samples', None)
+            strm_n.newProp('received', str(sum(self.__streamed)))
+            strm_n.newProp('dropped', str(sum(self.__dropped)))
 
-            rep_n.addChild(self.__cyclicdata[str(thr)].MakeReport())
+        rep_n.addChild(self.__cyclicdata["system"].MakeReport())
+        for node in self.__nodes:
+            rep_n.addChild(self.__cyclicdata[node].MakeReport())
+        for (i, cpu) in enumerate(self.__cpus):
+            core_n = self.__cyclicdata[cpu].MakeReport()
+            if self.__live:
+                core_n.newProp('dropped_samples', str(self.__dropped[i]))
+            rep_n.addChild(core_n)
+
+        # The system latencies of each load stage, for the latency versus load curve
+        # The stage histograms only hold the streamed samples, so the number
+        # of samples dropped during each stage is reported along with them
+        for (stage, level, rd, start, end, dropped) in self.__stages:
+            stage_n = rd.MakeReport()
+            stage_n.newProp('load_level', '%g' % level)
+            stage_n.newProp('duration', '%.1f' % (end - start))
+            stage_n.newProp('dropped_samples', str(dropped))
+            rep_n.addChild(stage_n)
 
         return rep_n
 
@@ -389,7 +1352,28 @@ def ModuleParameters():
                          "metavar": "PRIO"},
             "breaktrace": {"descr": "Send a break trace command when latency > USEC",
                            "default": None,
-                           "metavar": "USEC"}
+                           "metavar": "USEC"},
+            "live":     {"descr": "Stream samples into the histograms during the run (1/0)",
+                         "default": None,
+                         "metavar": "BOOL"},
+            "percentiles": {"descr": "Comma separated list of latency percentiles to report",
+                            "default": "99,99.9,99.99,99.999,99.9999",
+                            "metavar": "LIST"},
+            "histogram": {"descr": "Histogram format in the report, linear or loglinear",
+                          "default": "linear",
+                          "metavar": "TYPE"},
+            "slice":    {"descr": "Record per core latency summaries every SECONDS (implies live mode)",
+                         "default": None,
+                         "metavar": "SECONDS"},
+            "cpulist":  {"descr": "Only measure the CPUs in CPULIST, such as 2-5,8 (default: all online CPUs)",
+                         "default": None,
+                         "metavar": "CPULIST"},
+            "sla":      {"descr": "Abort the run when a latency limit is exceeded, such as max=150,99.99=80 (implies live mode)",
+                         "default": None,
+                         "metavar": "LIMITS"},
+            "slascope": {"descr": "Check the SLA percentiles of each core or of the whole system",
+                         "default": "system",
+                         "metavar": "core|system"}
             }
 
 
@@ -398,6 +1382,189 @@ def create(params, logger):
     return Cyclictest(params, logger)
 
 
+def unit_test(rootdir):
+    try:
+        # Every latency must map to a bucket starting at or below it,
+        # within the relative error given by the precision
+        h = LogLinearHistogram(8)
+        for v in range(0, 5000) + [2**20 + 12345, 2**31 + 7]:
+            low = h.value(h.index(v))
+            if low > v or (v - low) > v / 128.0:
+                print "** Bucket for %i starts at %i" % (v, low)
+                return 1
+        print "Log-linear bucket mapping: OK"
+
+        # Merging must be the same as counting everything in one histogram
+        (a, b, c) = (LogLinearHistogram(), LogLinearHistogram(), LogLinearHistogram())
+        for v in range(0, 30000, 7):
+            a.add(v)
+            c.add(v)
+        for v in range(3, 90000, 13):
+            b.add(v, 2)
+            c.add(v, 2)
+        a.merge(b)
+        if a.used() != c.used():
+            print "** Merged log-linear histograms differ"
+            return 1
+        print "Log-linear histogram merge: OK"
+
+        # Runs merged from their reports must match a single run with all the
+        # samples, which is what merging reports of several runs relies on
+        runs = []
+        for (first, step, ovfl) in ((0, 7, 0), (3, 13, 2)):
+            rd = RunData('0', 'core', 95, lambda t, m: None,
+                         quantiles=['50', '99', '99.99'], histtype='loglinear')
+            for v in range(first, 90000, step):
+                rd.sample(v)
+            rd.overflow(ovfl)
+            rd.reduce()
+            runs.append(rd)
+        merged = RunData('0', 'core', 95, lambda t, m: None,
+                         quantiles=['50', '99', '99.99'], histtype='loglinear')
+        for rd in runs:
+            merged.mergereport(libxml2.parseDoc(rd.MakeReport().serialize()).getRootElement())
+        runs[0].merge(runs[1])
+        for rd in (merged, runs[0]):
+            rd.reduce()
+        if merged.MakeReport().serialize() != runs[0].MakeReport().serialize():
+            print "** Merged reports differ: %s, expected %s" % (merged.Summary(), runs[0].Summary())
+            return 1
+        try:
+            linear = RunData('0', 'core', 95, lambda t, m: None, nbuckets=100)
+            linear.mergereport(libxml2.parseDoc(runs[1].MakeReport().serialize()).getRootElement())
+            print "** A log-linear report merged into a linear histogram"
+            return 1
+        except ValueError:
+            pass
+        print "Log-linear report merge: OK"
+
+        # Percentiles using the nearest rank method
+        rd = RunData('0', 'core', 95, lambda t, m: None, nbuckets=100,
+                     quantiles=['50', '99', '99.9', '100'])
+        for v in range(1, 1001):
+            rd.sample(v % 100)
+        pct = rd.Percentiles(['50', '99', '99.9', '100'])
+        if pct != [('50', 49), ('99', 98), ('99.9', 99), ('100', 99)]:
+            print "** Unexpected percentiles: %s" % str(pct)
+            return 1
+        print "Percentiles: OK"
+
+        # Confidence intervals of percentiles, from the ranks bounding the
+        # binomial spread: 1000 samples give a spread of 31 ranks around the
+        # median and of 6 ranks around the 99th percentile
+        bounds = (rd.PercentileBounds('50'), rd.PercentileBounds('99'))
+        if bounds != ((46, 49, 53), (98, 98, 99)):
+            print "** Unexpected percentile bounds: %s" % str(bounds)
+            return 1
+        if RunData('1', 'core', 95, lambda t, m: None).PercentileBounds('99') is not None:
+            print "** Percentile bounds without samples"
+            return 1
+        print "Percentile bounds: OK"
+
+        # Convergence of the live percentiles over two windows
+        from rteval.modules.measurement import percentiles_converged
+        stable = [{'0': (90, 100, 104), '1': (40, 42, 43)},
+                  {'0': (98, 103, 106), '1': (41, 42, 43)},
+                  {'0': (97, 101, 105), '1': (40, 41, 43)}]
+        checks = [(stable, True),
+                  # too few windows
+                  (stable[1:], False),
+                  # the estimate of core 0 moved by more than 5%
+                  (stable[:2] + [{'0': (105, 109, 112), '1': (40, 41, 43)}], False),
+                  # the confidence interval of core 1 is too wide
+                  (stable[:2] + [{'0': (95, 101, 105), '1': (38, 41, 45)}], False),
+                  # a core without a reliable estimate
+                  (stable[:2] + [{'0': (95, 101, 105), '1': None}], False),
+                  # a core missing in the previous window
+                  (stable[:1] + [{'0': (98, 103, 106)}] + stable[2:], False),
+                  (stable[:2] + [{}], False)]
+        for (history, expected) in checks:
+            if percentiles_converged(history, 0.05, 2) != expected:
+                print "** Convergence of %s is not %s" % (str(history), expected)
+                return 1
+        if not percentiles_converged([stable[0]] + stable, 0.05, 2):
+            print "** Convergence must only look at the last windows"
+            return 1
+        print "Percentile convergence: OK"
+
+        # Histogram rows missing a column are skipped, not truncating the others
+        (indexes, columns, comments) = parse_histogram(["000000\t000001\t000002\n",
+                                                        "000001\t000003\n",
+                                                        "# Total: 000000001 000000006\n",
+                                                        "000002\t000000\t000004\n",
+                                                        "\n"])
+        if (indexes, columns, len(comments)) != ([0, 2], [[1, 0], [2, 4]], 1):
+            print "** Unexpected histogram: %s" % str((indexes, columns, comments))
+            return 1
+        print "Incomplete histogram rows: OK"
+
+        # Thread statistics and overflows, from the summary lines
+        summary = {}
+        for line in ["# Min Latencies: 00001 00002\n",
+                     "# Avg Latencies: 00005 00006\n",
+                     "# Max Latencies: 00150 00020\n",
+                     "# Histogram Overflows: 00007 00000\n",
+                     "# Histogram Overflow at cycle number:\n",
+                     "# Thread 0: 00011 00012 00013 00014 00015 # 00002 others\n",
+                     "# Thread 1:\n"]:
+            parse_summary_line(line, summary)
+        if summary != {'Min Latencies': [1, 2], 'Avg Latencies': [5, 6],
+                       'Max Latencies': [150, 20], 'Histogram Overflows': [7, 0],
+                       'cycles': {0: ([11, 12, 13, 14, 15], 2), 1: ([], 0)}}:
+            print "** Unexpected summary: %s" % str(summary)
+            return 1
+
+        # 93 samples in the histogram and 7 overflows, the highest of which is
+        # only known from the thread statistics
+        rd = RunData('0', 'core', 95, lambda t, m: None, nbuckets=100)
+        rd.buckets(range(10, 41), [3] * 31)
+        rd.overflow(summary['Histogram Overflows'][0], *summary['cycles'][0])
+        rd.threadstats(*[summary[k][0] for k in ('Min Latencies', 'Avg Latencies', 'Max Latencies')])
+        pct = rd.Percentiles(['50', '93', '94'])
+        if rd.Summary()['max'] != 150 or pct != [('50', 26), ('93', 40), ('94', 150)]:
+            print "** Unexpected overflow statistics: %s %s" % (str(rd.Summary()), str(pct))
+            return 1
+        print "Overflows and thread statistics: OK"
+
+        # Time slices: once there are more than maxslices, neighbouring slices
+        # are merged and the slice length doubles
+        sl = LatencySlices(1.0, 100.0, maxslices=4)
+        if sl.roll(100.5):
+            print "** Time slice closed early"
+            return 1
+        for (t, values) in enumerate([[5, 7], [9], [], [3, 4, 30], [6]]):
+            for v in values:
+                sl.sample(v)
+            sl.roll(101.0 + t)
+        if sl.GetSlices() != [(100.0, 2.0, 3, 9, 9), (102.0, 2.0, 3, 30, 30), (104.0, 1.0, 1, 6, 6)]:
+            print "** Unexpected merged time slices: %s" % str(sl.GetSlices())
+            return 1
+        if sl.roll(106.5) or not sl.roll(107.0):
+            print "** Time slice length not doubled"
+            return 1
+
+        sl = LatencySlices(1.0, 0.0)
+        for t in range(1, 2001):
+            sl.sample(t)
+            sl.roll(float(t), force=True)
+        slices = sl.GetSlices()
+        if len(slices) > 512 or sum([s[2] for s in slices]) != 2000 or slices[-1][3] != 2000:
+            print "** Time slices not capped: %d slices" % len(slices)
+            return 1
+        print "Time slices: OK"
+
+        # CPU lists
+        if parse_cpulist('0-3, 8,10-11,2') != [0, 1, 2, 3, 8, 10, 11] \
+                or collapse_cpulist([11, 0, 1, 2, 3, 8, 10]) != '0-3,8,10-11':
+            print "** CPU list parsing failed"
+            return 1
+        print "CPU lists: OK"
+        return 0
+    except Exception, e:
+        print "** EXCEPTION %s", str(e)
+        return 1
+
+
 if __name__ == '__main__':
     from rteval.rtevalConfig import rtevalConfig
     
@@ -75,7 +75,32 @@ default_config = {
         'xmlrpc'     : None,
         'xslt_report': default_config_search(['rteval_text.xsl'], os.path.isfile),
         'report_interval': '600',
+        'poll_interval': '0.25',
+        'ready_timeout': '1800',
+        'module_backend': 'thread',
+        'stop_timeout': '15',
+        'measure_stop_timeout': '300',
+        'cpuload_interval': '1',
+        'cpuload_buffer': '3600',
+        'load_target': None,
+        'load_metric': 'util',
+        'load_control_interval': '5',
+        'load_kp': '1.0',
+        'load_ki': '0.05',
+        'load_kd': '0',
+        'load_min_intensity': '0.1',
+        'load_max_intensity': '4',
+        'load_ramp': None,
+        'load_ramp_settle': '10',
         'logging'    : False,
+        'timings'    : False,
+        'prewarm'    : False,
+        'measure_cpulist': None,
+        'housekeeping_cpulist': None,
+        'converge'   : None,
+        'converge_tolerance': '5',
+        'converge_windows': '3',
+        'converge_interval': '60',
         }
     }
 
@@ -24,7 +24,7 @@
 #   are deemed to be part of the source code.
 #
 
-import os, tarfile
+import os, tarfile, json
 from datetime import datetime
 import xmlout
 from sysinfo.tools import mkdir, chown
@@ -39,6 +39,10 @@ class rtevalReport(object):
         self.__xmlreport = None
         self.__reportdir = None
         self.__xmlfname = None
+        # (module name, reason) of modules which aborted the run
+        self._aborted = []
+        # (percentile, converged) of an adaptive run
+        self._convergence = None
 
 
     def _report(self, measure_start, xslt_tpl):
@@ -66,6 +70,12 @@ class rtevalReport(object):
         self.__xmlreport.taggedvalue('time', self.__start.strftime('%H:%M:%S'))
         if self.__annotate:
             self.__xmlreport.taggedvalue('annotate', self.__annotate)
+        for (modname, reason) in self._aborted:
+            self.__xmlreport.taggedvalue('aborted', reason, {'module': modname})
+        if self._convergence:
+            (quantile, converged) = self._convergence
+            self.__xmlreport.taggedvalue('convergence', converged and 'converged' or 'not converged',
+                                         {'percentile': quantile})
         self.__xmlreport.closeblock()
 
         # Collect and add info about the system
@@ -90,6 +100,24 @@ class rtevalReport(object):
         self.__xmlreport.Write("-", xslt_tpl)
 
 
+    def _write_timings(self, fname="timings.json"):
+        "Writes the time each module spent in its phases as JSON to the report directory"
+
+        if self.__reportdir is None:
+            return None
+
+        timings = {'start': self.__start.strftime('%Y-%m-%d %H:%M:%S'),
+                   'loads': self._loadmods.GetTimings(),
+                   'measurement': self._measuremods.GetTimings()}
+        fname = os.path.join(self.__reportdir, fname)
+        fp = open(fname, 'w')
+        json.dump(timings, fp, indent=2, sort_keys=True)
+        fp.write("\n")
+        fp.close()
+        chown(fname)
+        return fname
+
+
     def GetXMLreport(self):
         "Retrieves the complete rteval XML report as a libxml2.xmlDoc object"
         return self.__xmlreport.GetXMLdocument()
@@ -23,6 +23,18 @@
       <xsl:text>   Remarks:      </xsl:text>
       <xsl:value-of select="run_info/annotate"/>
     </xsl:if>
+    <xsl:if test="run_info/convergence">
+      <xsl:text>&#10;   Adaptive:     p</xsl:text>
+      <xsl:value-of select="run_info/convergence/@percentile"/>
+      <xsl:text> latencies </xsl:text>
+      <xsl:value-of select="run_info/convergence"/>
+    </xsl:if>
+    <xsl:for-each select="run_info/aborted">
+      <xsl:text>&#10;   Aborted:      </xsl:text>
+      <xsl:value-of select="@module"/>
+      <xsl:text>: </xsl:text>
+      <xsl:value-of select="."/>
+    </xsl:for-each>
     <xsl:text>&#10;&#10;</xsl:text>
 
     <xsl:text>   Tested node:  </xsl:text>
@@ -129,6 +141,32 @@
     <xsl:text>       Load average: </xsl:text>
     <xsl:value-of select="loads/@load_average"/>
     <xsl:text>&#10;</xsl:text>
+    <xsl:for-each select="loads/cpuload/cpugroup">
+      <xsl:text>       CPU utilisation (</xsl:text>
+      <xsl:value-of select="@name"/>
+      <xsl:text>: </xsl:text>
+      <xsl:value-of select="@cpulist"/>
+      <xsl:text>): mean </xsl:text>
+      <xsl:value-of select="@mean"/>
+      <xsl:text>%, p50 </xsl:text>
+      <xsl:value-of select="@p50"/>
+      <xsl:text>%, p99 </xsl:text>
+      <xsl:value-of select="@p99"/>
+      <xsl:text>%, max </xsl:text>
+      <xsl:value-of select="@max"/>
+      <xsl:text>%&#10;</xsl:text>
+    </xsl:for-each>
+    <xsl:if test="loads/loadcontrol">
+      <xsl:text>       Load control: </xsl:text>
+      <xsl:value-of select="loads/loadcontrol/@metric"/>
+      <xsl:text> target </xsl:text>
+      <xsl:value-of select="loads/loadcontrol/@target"/>
+      <xsl:text>, final intensity </xsl:text>
+      <xsl:value-of select="loads/loadcontrol/@intensity"/>
+      <xsl:text> after </xsl:text>
+      <xsl:value-of select="count(loads/loadcontrol/step)"/>
+      <xsl:text> steps&#10;</xsl:text>
+    </xsl:if>
 
     <xsl:if test="loads/command_line">
       <xsl:text>&#10;</xsl:text>
@@ -157,6 +195,21 @@
       <xsl:otherwise>(Not run)</xsl:otherwise>
     </xsl:choose>
     <xsl:text>&#10;</xsl:text>
+    <xsl:for-each select="throughput/metric">
+      <xsl:text>             </xsl:text>
+      <xsl:value-of select="@name"/>
+      <xsl:text>: </xsl:text>
+      <xsl:value-of select="@count"/>
+      <xsl:text> (</xsl:text>
+      <xsl:value-of select="format-number(@rate, '0.###')"/>
+      <xsl:text>/s)</xsl:text>
+      <xsl:if test="@mean">
+        <xsl:text>, </xsl:text>
+        <xsl:value-of select="format-number(@mean, '0.###')"/>
+        <xsl:text>s each</xsl:text>
+      </xsl:if>
+      <xsl:text>&#10;</xsl:text>
+    </xsl:for-each>
   </xsl:template>
 
 
@@ -205,6 +258,12 @@
 
     <xsl:apply-templates select="abort_report"/>
 
+    <xsl:if test="streamed_samples/@dropped &gt; 0">
+      <xsl:text>          Dropped: </xsl:text>
+      <xsl:value-of select="streamed_samples/@dropped"/>
+      <xsl:text> of the streamed samples, live decisions were not taken&#10;&#10;</xsl:text>
+    </xsl:if>
+
     <xsl:text>          System:  </xsl:text>
     <xsl:value-of select="system/@description"/>
     <xsl:text>&#10;</xsl:text>
@@ -212,10 +271,40 @@
     <xsl:text>          Statistics: &#10;</xsl:text>
     <xsl:apply-templates select="system/statistics"/>
 
+    <!-- Add NUMA node info and stats-->
+    <xsl:apply-templates select="node">
+      <xsl:sort select="@id" data-type="number"/>
+    </xsl:apply-templates>
+
     <!-- Add CPU core info and stats-->
     <xsl:apply-templates select="core">
       <xsl:sort select="@id" data-type="number"/>
     </xsl:apply-templates>
+
+    <!-- Add the stats of each load stage -->
+    <xsl:apply-templates select="stage">
+      <xsl:sort select="@id" data-type="number"/>
+    </xsl:apply-templates>
+  </xsl:template>
+
+
+  <!--  Format the load stage section in the cyclict test part -->
+  <xsl:template match="/rteval/Measurements/Profile/cyclictest/stage">
+    <xsl:text>          Load stage </xsl:text>
+    <xsl:value-of select="@id"/>
+    <xsl:text>     Load level: </xsl:text>
+    <xsl:value-of select="@load_level"/>
+    <xsl:text>%     Duration: </xsl:text>
+    <xsl:value-of select="@duration"/>
+    <xsl:text>s</xsl:text>
+    <xsl:if test="@dropped_samples &gt; 0">
+      <xsl:text>     Dropped samples: </xsl:text>
+      <xsl:value-of select="@dropped_samples"/>
+    </xsl:if>
+    <xsl:text>&#10;</xsl:text>
+    <xsl:text>          Statistics: </xsl:text>
+    <xsl:text>&#10;</xsl:text>
+    <xsl:apply-templates select="statistics"/>
   </xsl:template>
 
 
@@ -232,6 +321,17 @@
   </xsl:template>
 
 
+  <!--  Format the NUMA node section in the cyclict test part -->
+  <xsl:template match="/rteval/Measurements/Profile/cyclictest/node">
+    <xsl:text>          NUMA node </xsl:text>
+    <xsl:value-of select="@id"/>
+    <xsl:text>&#10;</xsl:text>
+    <xsl:text>          Statistics: </xsl:text>
+    <xsl:text>&#10;</xsl:text>
+    <xsl:apply-templates select="statistics"/>
+  </xsl:template>
+
+
   <!-- Generic formatting of statistics information -->
   <xsl:template match="/rteval/Measurements/Profile/cyclictest/*/statistics">
     <xsl:text>            Samples:           </xsl:text>
@@ -278,6 +378,21 @@
       <xsl:value-of select="standard_deviation"/>
       <xsl:value-of select="standard_deviation/@unit"/>
       <xsl:text>&#10;</xsl:text>
+
+      <xsl:for-each select="percentile">
+        <xsl:text>            </xsl:text>
+        <xsl:value-of select="concat('P', @q, ':')"/>
+        <xsl:value-of select="substring('                   ', string-length(concat('P', @q, ':')) + 1)"/>
+        <xsl:value-of select="."/>
+        <xsl:value-of select="@unit"/>
+        <xsl:text>&#10;</xsl:text>
+      </xsl:for-each>
+
+      <xsl:if test="histogram_overflows > 0">
+        <xsl:text>            Hist. overflows:   </xsl:text>
+        <xsl:value-of select="histogram_overflows"/>
+        <xsl:text>&#10;</xsl:text>
+      </xsl:if>
     </xsl:if>
     <xsl:text>&#10;</xsl:text>
   </xsl:template>
@@ -355,6 +470,23 @@
         <xsl:value-of select="breaktrace/@measured_latency"/>
         <xsl:text>us.&#10;&#10;</xsl:text>
       </xsl:if>
+
+      <xsl:if test="sla_breach">
+        <xsl:text>                   </xsl:text>
+        <xsl:text>Aborted due to </xsl:text>
+        <xsl:value-of select="sla_breach/@limit"/>
+        <xsl:text> latency on </xsl:text>
+        <xsl:value-of select="sla_breach/@scope"/>
+        <xsl:text> </xsl:text>
+        <xsl:value-of select="sla_breach/@id"/>
+        <xsl:text> exceeding </xsl:text>
+        <xsl:value-of select="sla_breach/@threshold"/>
+        <xsl:text>us.&#10;</xsl:text>
+        <xsl:text>                   </xsl:text>
+        <xsl:text>Measured latency was </xsl:text>
+        <xsl:value-of select="sla_breach/@measured_latency"/>
+        <xsl:text>us.&#10;&#10;</xsl:text>
+      </xsl:if>
   </xsl:template>
 
 </xsl:stylesheet>
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License along
+#   with this program; if not, write to the Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#   For the avoidance of doubt the "preferred form" of this code is one which
+#   is in an open unpatent encumbered format. Where cryptographic key signing
+#   forms part of the process of creating an executable the information
+#   including keys needed to generate an equivalently functional executable
+#   are deemed to be part of the source code.
+#
+
+import sys, os, time, threading, libxml2
+from array import array
+from rteval.Log import Log
+from rteval.sysinfo.cputopology import parse_cpulist, collapse_cpulist
+
+# Marks a ring buffer slot where a CPU was not sampled, such as while it was offline
+NOSAMPLE = 255
+
+
+def read_procstat(root="/"):
+    """Returns a dictionary mapping each online CPU to its (busy, total) jiffies,
+and the number of runnable processes, read from /proc/stat"""
+    ret = {}
+    running = 0
+    fp = open(os.path.join(root, 'proc', 'stat'), 'r')
+    for line in fp:
+        if line.startswith('procs_running'):
+            running = int(line.split()[1])
+        if not line.startswith('cpu') or line.startswith('cpu '):
+            continue
+        fields = line.split()
+        # user nice system idle iowait irq softirq steal, where guest time
+        # already is accounted for as user time
+        jiffies = [int(f) for f in fields[1:9]]
+        total = sum(jiffies)
+        ret[int(fields[0][3:])] = (total - sum(jiffies[3:5]), total)
+    fp.close()
+    return (ret, running)
+
+
+def read_loadavg(root="/"):
+    "Returns the one minute load average, read from /proc/loadavg"
+    fp = open(os.path.join(root, 'proc', 'loadavg'), 'r')
+    load = float(fp.readline().split()[0])
+    fp.close()
+    return load
+
+
+class CpuLoadSampler(threading.Thread):
+    """Samples the utilisation of each CPU from /proc/stat and the load average
+at a fixed interval in the background.  The samples of the last size intervals
+are kept in ring buffers of one byte per CPU, for the load over time, while a
+histogram per CPU of the utilisation percentages covers the whole run"""
+
+    def __init__(self, interval=1.0, size=3600, cpugroups=(), logger=None, root="/"):
+        threading.Thread.__init__(self, name="cpuload")
+        self.daemon = True
+        self.__interval = float(interval)
+        self.__size = int(size)
+        self.__cpugroups = [(name, parse_cpulist(cpulist)) for (name, cpulist) in cpugroups]
+        self.__logger = logger
+        self.__root = root
+        self.__stopev = threading.Event()
+        self.__lock = threading.Lock()
+        self.__started = None
+        self.__cpus = []
+        self.__util = {}
+        self.__hist = {}
+        self.__times = array('d', [0.0]) * self.__size
+        self.__loadavg = array('f', [0.0]) * self.__size
+        self.__next = 0
+        self.__samples = 0
+        self.__loadavg_accum = 0.0
+        self.__listeners = []
+
+
+    def __log(self, logtype, msg):
+        if self.__logger:
+            self.__logger.log(logtype, "[cpuload] %s" % msg)
+
+
+    def AddListener(self, func):
+        """Calls func(time, utilisation, running) after each sample, with a dictionary
+of the utilisation percentage of each sampled CPU and the number of runnable
+processes.  It is called from the sampler thread"""
+        self.__listeners.append(func)
+
+
+    def run(self):
+        try:
+            (prev, running) = read_procstat(self.__root)
+            self.__started = time.time()
+            self.__cpus = sorted(prev.keys())
+            for cpu in self.__cpus:
+                self.__util[cpu] = array('B', [NOSAMPLE]) * self.__size
+                self.__hist[cpu] = array('L', [0]) * 101
+
+            nextsample = self.__started + self.__interval
+            while not self.__stopev.wait(max(nextsample - time.time(), 0.0)):
+                nextsample += self.__interval
+                now = time.time()
+                (cur, running) = read_procstat(self.__root)
+                util = self.__add(now, prev, cur, read_loadavg(self.__root))
+                prev = cur
+                for func in self.__listeners:
+                    func(now, util, running)
+        except (IOError, ValueError), e:
+            self.__log(Log.WARN, "Sampling stopped: %s" % str(e))
+
+
+    def __add(self, now, prev, cur, loadavg):
+        """Stores the utilisation of each CPU between two /proc/stat readings.  Returns
+a dictionary with the utilisation of the CPUs which were sampled"""
+        ret = {}
+        self.__lock.acquire()
+        try:
+            pos = self.__next
+            for cpu in self.__cpus:
+                if cpu in prev and cpu in cur and cur[cpu][1] > prev[cpu][1]:
+                    busy = cur[cpu][0] - prev[cpu][0]
+                    util = min(max(int(round(100.0 * busy / (cur[cpu][1] - prev[cpu][1]))), 0), 100)
+                    self.__hist[cpu][util] += 1
+                    ret[cpu] = util
+                else:
+                    util = NOSAMPLE
+                self.__util[cpu][pos] = util
+            self.__times[pos] = now
+            self.__loadavg[pos] = loadavg
+            self.__loadavg_accum += loadavg
+            self.__samples += 1
+            self.__next = (pos + 1) % self.__size
+        finally:
+            self.__lock.release()
+        return ret
+
+
+    def stop(self):
+        "Stops sampling"
+        self.__stopev.set()
+        if self.is_alive():
+            self.join()
+
+
+    def GetSamples(self):
+        "Returns the number of samples taken"
+        return self.__samples
+
+
+    def GetLoadAvg(self):
+        "Returns the mean load average over all samples, or None without samples"
+        if self.__samples == 0:
+            return None
+        return self.__loadavg_accum / self.__samples
+
+
+    def __stats(self, hist):
+        "Returns the utilisation statistics of a histogram, or None when it is empty"
+        count = sum(hist)
+        if count == 0:
+            return None
+        ret = {'samples': count,
+               'mean': sum([u * n for (u, n) in enumerate(hist)]) / float(count),
+               'min': min([u for (u, n) in enumerate(hist) if n]),
+               'max': max([u for (u, n) in enumerate(hist) if n])}
+        for q in (50, 90, 99):
+            limit = count * q / 100.0
+            seen = 0
+            for (u, n) in enumerate(hist):
+                seen += n
+                if seen >= limit:
+                    ret['p%i' % q] = u
+                    break
+        return ret
+
+
+    def GetStats(self):
+        """Returns a dictionary of the utilisation statistics of each CPU and of each
+CPU group: the number of samples, mean, min, max and the 50th, 90th and 99th
+percentiles, in percent"""
+        self.__lock.acquire()
+        try:
+            ret = {'cpus': {}, 'groups': {}}
+            for cpu in self.__cpus:
+                ret['cpus'][cpu] = self.__stats(self.__hist[cpu])
+            for (name, cpus) in self.__groups():
+                hist = [0] * 101
+                for cpu in cpus:
+                    for (u, n) in enumerate(self.__hist[cpu]):
+                        hist[u] += n
+                ret['groups'][name] = self.__stats(hist)
+            return ret
+        finally:
+            self.__lock.release()
+
+
+    def __groups(self):
+        "Returns the CPU groups, limited to the sampled CPUs, with 'all' first"
+        ret = [('all', self.__cpus)]
+        for (name, cpus) in self.__cpugroups:
+            cpus = [c for c in cpus if c in self.__util]
+            if cpus:
+                ret.append((name, cpus))
+        return ret
+
+
+    def GetTimeline(self, points=60):
+        """Returns the samples still in the ring buffer, merged into at most points
+(offset, load average, {group: mean utilisation}) tuples, where the offset is
+the number of seconds since sampling started.  The utilisation of a group is None
+when none of its CPUs were sampled"""
+        self.__lock.acquire()
+        try:
+            count = min(self.__samples, self.__size)
+            first = (self.__next - count) % self.__size
+            order = [(first + i) % self.__size for i in range(count)]
+            per_point = max((count + points - 1) / points, 1)
+            groups = self.__groups()
+
+            ret = []
+            for start in range(0, count, per_point):
+                slots = order[start:start + per_point]
+                util = {}
+                for (name, cpus) in groups:
+                    vals = [self.__util[c][s] for c in cpus for s in slots
+                            if self.__util[c][s] != NOSAMPLE]
+                    util[name] = None
+                    if vals:
+                        util[name] = float(sum(vals)) / len(vals)
+                ret.append((self.__times[slots[-1]] - self.__started,
+                            sum([self.__loadavg[s] for s in slots]) / len(slots),
+                            util))
+            return ret
+        finally:
+            self.__lock.release()
+
+
+    def MakeReport(self):
+        rep_n = libxml2.newNode("cpuload")
+        rep_n.newProp("interval", "%g" % self.__interval)
+        rep_n.newProp("samples", str(self.__samples))
+        if self.__samples == 0:
+            return rep_n
+
+        stats = self.GetStats()
+        for (name, cpus) in self.__groups():
+            grp_n = rep_n.newChild(None, "cpugroup", None)
+            grp_n.newProp("name", name)
+            grp_n.newProp("cpulist", collapse_cpulist(cpus))
+            self.__statprops(grp_n, stats['groups'][name])
+
+        for cpu in self.__cpus:
+            cpu_n = rep_n.newChild(None, "cpu", None)
+            cpu_n.newProp("id", str(cpu))
+            self.__statprops(cpu_n, stats['cpus'][cpu])
+
+        tl_n = rep_n.newChild(None, "timeline", None)
+        for (offset, loadavg, util) in self.GetTimeline():
+            pt_n = tl_n.newChild(None, "point", None)
+            pt_n.newProp("offset", "%.1f" % offset)
+            pt_n.newProp("loadavg", "%.2f" % loadavg)
+            for (name, cpus) in self.__groups():
+                if util[name] is not None:
+                    pt_n.newProp(name, "%.1f" % util[name])
+
+        return rep_n
+
+
+    def __statprops(self, node, stats):
+        if not stats:
+            return
+        node.newProp("mean", "%.1f" % stats['mean'])
+        for k in ('min', 'p50', 'p90', 'p99', 'max'):
+            node.newProp(k, str(stats[k]))
+
+
+
+def unit_test(rootdir):
+    try:
+        sampler = CpuLoadSampler(interval=0.1, size=10, logger=Log())
+        sampler.start()
+        time.sleep(1.5)
+        sampler.stop()
+
+        print " ---- XML Result ---- "
+        x = libxml2.newDoc('1.0')
+        x.setRootElement(sampler.MakeReport())
+        x.saveFormatFileEnc('-','UTF-8',1)
+
+        print "Samples: %i - load average: %.2f" % (sampler.GetSamples(), sampler.GetLoadAvg())
+        return sampler.GetSamples() > 0 and 0 or 1
+    except Exception, e:
+        print "** EXCEPTION %s", str(e)
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(unit_test(None))
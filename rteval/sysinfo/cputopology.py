@@ -25,6 +25,74 @@
 
 import sys, os, libxml2
 
+
+def parse_cpulist(cpulist):
+    "Expands a cpulist string, such as '0-3,8,10-11', into a sorted list of CPU numbers"
+    cpus = set()
+    for part in str(cpulist).strip().split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            (first, last) = [int(c) for c in part.split('-', 1)]
+            if first > last:
+                raise ValueError("Invalid CPU range: %s" % part)
+            cpus.update(range(first, last + 1))
+        else:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+
+def collapse_cpulist(cpus):
+    "Collapses a list of CPU numbers into a cpulist string, such as '0-3,8,10-11'"
+    ranges = []
+    for cpu in sorted(set(cpus)):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join([(f == l) and str(f) or "%d-%d" % (f, l) for (f, l) in ranges])
+
+
+def online_cpus(root="/"):
+    "Returns a sorted list of the online CPUs, read from /sys/devices/system/cpu/online"
+    try:
+        fp = open(os.path.join(root, 'sys', 'devices', 'system', 'cpu', 'online'), 'r')
+        cpus = parse_cpulist(fp.readline())
+        fp.close()
+        return cpus
+    except (IOError, ValueError):
+        # Fall back to the processors listed in /proc/cpuinfo
+        cpus = []
+        fp = open(os.path.join(root, 'proc', 'cpuinfo'), 'r')
+        for line in fp:
+            if line.startswith('processor'):
+                cpus.append(int(line.split()[-1]))
+        fp.close()
+        return sorted(cpus)
+
+
+def cpu_nodes(root="/"):
+    "Returns a dictionary mapping each CPU to its NUMA node, read from /sys/devices/system/node"
+    ret = {}
+    nodedir = os.path.join(root, 'sys', 'devices', 'system', 'node')
+    if not os.path.isdir(nodedir):
+        return ret
+
+    for dirname in os.listdir(nodedir):
+        if not dirname.startswith('node'):
+            continue
+        try:
+            node = int(dirname[4:])
+        except ValueError:
+            continue
+        fp = open(os.path.join(nodedir, dirname, 'cpulist'), 'r')
+        for cpu in parse_cpulist(fp.readline()):
+            ret[cpu] = node
+        fp.close()
+    return ret
+
+
 class CPUtopology:
     "Retrieves an overview over the installed CPU cores and the system topology"
 
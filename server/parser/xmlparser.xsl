@@ -397,7 +397,7 @@
                     <xsl:if test="@command_line">
                       <command_line><xsl:value-of select="@command_line"/></command_line>
                     </xsl:if>
-                    <xsl:copy-of select="timestamps"/>
+                    <xsl:copy-of select="timestamps|timings"/>
                   </module>
                 </xsl:for-each>
               </Measurement>
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+#
+#   cyclictest_benchmark.py - times the parsing of cyclictest histogram output
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License along
+#   with this program; if not, write to the Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import os, sys, time, random
+from itertools import izip
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from rteval.modules.measurement.cyclictest import RunData, parse_histogram
+
+
+def synthetic_output(ncores, nbuckets):
+    "Generates cyclictest histogram output with ncores columns"
+    lines = ["# Histogram\n"]
+    for i in range(nbuckets):
+        if i < 50:
+            vals = ["%06d" % random.randint(0, 100000) for c in range(ncores)]
+        else:
+            vals = ["%06d" % (random.random() < 0.001 and 1 or 0) for c in range(ncores)]
+        lines.append("%06d\t%s\n" % (i, "\t".join(vals)))
+    lines.append("# Total: %s\n" % " ".join(["000000000"] * ncores))
+    return lines
+
+
+def new_rundata(ncores, nbuckets):
+    log = lambda t, m: None
+    data = {'system': RunData('system', 'system', 95, log, nbuckets=nbuckets)}
+    for c in range(ncores):
+        data[str(c)] = RunData(str(c), 'core', 95, log, nbuckets=nbuckets)
+    return data
+
+
+def parse_per_line(data, lines):
+    "The previous parser, calling bucket() for every column of every line"
+    for line in lines:
+        if line.startswith('#'):
+            continue
+        vals = line.split()
+        index = int(vals[0])
+        for i in range(0, len(data)-1):
+            if str(i) not in data: continue
+            data[str(i)].bucket(index, int(vals[i+1]))
+            data['system'].bucket(index, int(vals[i+1]))
+
+
+def parse_columnar(data, lines):
+    "The bulk columnar parser used by the cyclictest module"
+    (indexes, columns, comments) = parse_histogram(lines)
+    for i in range(0, len(data)-1):
+        data[str(i)].buckets(indexes, columns[i])
+    data['system'].buckets(indexes, [sum(r) for r in izip(*columns)])
+
+
+if __name__ == '__main__':
+    ncores = len(sys.argv) > 1 and int(sys.argv[1]) or 512
+    nbuckets = len(sys.argv) > 2 and int(sys.argv[2]) or 2000
+
+    print "Generating synthetic output: %i cores, %i buckets" % (ncores, nbuckets)
+    lines = synthetic_output(ncores, nbuckets)
+
+    summaries = []
+    for (name, parser) in (("per line", parse_per_line), ("columnar", parse_columnar)):
+        data = new_rundata(ncores, nbuckets)
+        start = time.time()
+        parser(data, lines)
+        parsed = time.time()
+        for rd in data.values():
+            rd.reduce()
+        done = time.time()
+        print "%-10s parse: %7.3fs   reduce: %7.3fs" % (name, parsed - start, done - parsed)
+        summaries.append(dict([(k, v.Summary()) for (k, v) in data.items()]))
+
+    if summaries[0] != summaries[1]:
+        print "** ERROR: parsers disagree"
+        sys.exit(1)
+    sys.exit(0)
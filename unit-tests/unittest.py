@@ -120,9 +120,13 @@ if __name__ == '__main__':
     # Load defined modules  ('subdir','import name')
     tests.LoadModules((
             ('rteval','cputopology'),
+            ('rteval/sysinfo','cpuload'),
             ('rteval','dmi'),
             ('rteval','rtevalConfig'),
             ('rteval','xmlout'),
+            ('rteval/modules','loads'),
+            ('rteval/modules/loads','kcompile'),
+            ('rteval/modules/measurement','cyclictest'),
             ('server','unittest')
             ))
     # Run all tests